@@ -0,0 +1,17 @@
+"""
+URL configuration used for ASGI requests (settings.ASGI_URLCONF).
+
+The catalogue and cart endpoints that have a native async view are matched first;
+every other URL resolves exactly as in backend_catalog.urls.
+"""
+from django.urls import path, re_path
+
+from catalog import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/products/', async_views.product_list),
+    re_path(r'^api/products/(?P<pk>[^/.]+)/$', async_views.product_detail),
+    path('api/categories/tree/', async_views.category_tree),
+    path('api/cart/', async_views.cart_detail),
+] + sync_urlpatterns
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'catalog.async_views.asgi_routing_middleware',
+    'catalog.db.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,6 +59,8 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'backend_catalog.urls'
+# ASGI requests resolve here instead: native async views for the hot catalogue and cart reads first.
+ASGI_URLCONF = 'backend_catalog.asgi_urls'
 
 TEMPLATES = [
     {
@@ -78,14 +83,89 @@ WSGI_APPLICATION = 'backend_catalog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning, applied by Django on every new connection (OPTIONS['init_command']).
+# WAL lets readers carry on while a writer commits, NORMAL sync is durable enough with WAL,
+# and the page cache (negative = KiB) plus mmap keep hot catalogue pages in memory.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # persistent connections (checked before reuse) instead of a reconnect per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # seconds a writer waits for the lock before giving up with "database is locked"
+            'timeout': 20,
+            # take the write lock at BEGIN: a transaction that read first can't fail to upgrade half-way
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
+        # tests run on a file too: an in-memory database shares one cache between connections, locks whole
+        # tables and ignores the busy timeout, so the concurrency tests wouldn't see the locking production does
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+# Read replicas for catalogue reads (catalog.db.PrimaryReplicaRouter). Locally, point CATALOG_REPLICA_DBS at one or
+# more comma-separated SQLite files and refresh them with `manage.py sync_replicas`; in production add the
+# replica aliases here instead. Shoppers who just wrote stay on the primary for DATABASE_REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for _index, _name in enumerate(filter(None, os.environ.get('CATALOG_REPLICA_DBS', '').split(',')), start=1):
+    DATABASES[f'replica{_index}'] = {**DATABASES['default'], 'NAME': _name, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{_index}')
+DATABASE_ROUTERS = ['catalog.db.PrimaryReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+# Write transactions that still hit SQLITE_BUSY are re-run this many times (catalog.db.retry_on_busy).
+SQLITE_BUSY_RETRIES = 3
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Catalogue responses, the category tree and facet counts live here. Local memory is per process;
+# for several workers on one host switch to the file backend:
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
 
 
+# Minutes a cart line keeps its stock reserved after the last add/update.
+# Expired holds are released by `manage.py release_expired_reservations` (cron) or on demand when stock runs short.
+CART_RESERVATION_MINUTES = 15
+# Guest (X-Cart-Token) carts untouched for this many days are removed by sweep_guest_carts.
+CART_GUEST_DAYS = 30
+# Each worker checks JWT revocations against an in-memory copy of the RevokedToken table, reloaded when a revocation
+# bumps the version in the cache, and at least this often in case workers don't share a cache.
+JWT_DENYLIST_REFRESH_SECONDS = 30
+
+
+# Product image derivatives (catalog.images): resized copies generated in a background thread pool after
+# each upload, served through the srcset of the image payloads. Formats in order of preference.
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640, 1280]
+PRODUCT_IMAGE_FORMATS = ['webp', 'jpeg']
+PRODUCT_IMAGE_QUALITY = 80
+PRODUCT_IMAGE_WORKERS = 2  # 0 = generate inline when the upload commits
+# Width of the listing card thumbnail (the smallest derivative at least this wide).
+PRODUCT_THUMBNAIL_WIDTH = 320
+# Originals and derivatives are stored once per content hash (catalog.storage) and deleted with their last reference,
+# unless written this recently (an identical upload may be in flight); compact_product_images sweeps those later.
+PRODUCT_IMAGE_BLOB_GRACE_SECONDS = 10 * 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, ProductVariant, Cart, CartItem
+from django.utils.html import format_html
+from .images import pick_derivative
+from .models import Category, Product, ProductImage, ProductVariant, Cart, CartItem, Order, OrderLine
+from .stock import designate_hot_variant, undesignate_hot_variant
 
 # Allows editing images directly on the Product admin page.
 class ProductImageInline(admin.TabularInline):
@@ -8,8 +11,12 @@ class ProductImageInline(admin.TabularInline):
     readonly_fields = ('image_preview',)
 
     def image_preview(self, obj):
-        from django.utils.html import mark_safe
-        return mark_safe(f'<img src="{obj.image.url}" width="150" height="auto" />')
+        # the 160px derivative rather than the full-size upload, once generated
+        if not obj.image:
+            return ''
+        path = pick_derivative(obj.derivatives, obj.image.name, 150)
+        url = obj.image.storage.url(path) if path else obj.image.url
+        return format_html('<img src="{}" width="150" height="auto" />', url)
 
 # Allows editing variants directly on the Product admin page.
 class ProductVariantInline(admin.TabularInline):
@@ -18,7 +25,9 @@ class ProductVariantInline(admin.TabularInline):
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'parent_category')
+    list_display = ('full_name', 'parent_category', 'depth')
+    list_select_related = ('parent_category',)
+    ordering = ('path',) # tree order: every parent directly followed by its subtree
     search_fields = ('name',)
     # Automatically creates the 'slug' from the 'name' field.
     prepopulated_fields = {'slug': ('name',)}
@@ -26,6 +35,7 @@ class CategoryAdmin(admin.ModelAdmin):
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
     list_display = ('product_name', 'category', 'is_active', 'created_at')
+    list_select_related = ('category',)
     list_filter = ('category', 'is_active')
     search_fields = ('product_name', 'description')
     prepopulated_fields = {'slug': ('product_name',)}
@@ -34,12 +44,39 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ('product', 'size', 'color', 'price', 'stock_quantity')
+    list_display = ('product', 'size', 'color', 'price', 'stock_quantity', 'reserved_quantity', 'stock_shards')
+    list_select_related = ('product',)
     list_filter = ('product__category',)
     search_fields = ('product__product_name',)
     # Makes it easier to edit price and stock quickly.
     list_editable = ('price', 'stock_quantity',)
+    actions = ('make_hot', 'make_regular')
+
+    # Flash-sale variants: spread their stock over buckets so concurrent adds don't queue on one row.
+    @admin.action(description='Mark as hot variant (split stock into 8 buckets)')
+    def make_hot(self, request, queryset):
+        for variant_id in queryset.values_list('pk', flat=True):
+            designate_hot_variant(variant_id)
+
+    @admin.action(description='Mark as regular variant')
+    def make_regular(self, request, queryset):
+        for variant_id in queryset.filter(stock_shards__gt=0).values_list('pk', flat=True):
+            undesignate_hot_variant(variant_id)
 
 # Basic admin views for Cart models
 admin.site.register(Cart)
-admin.site.register(CartItem)
\ No newline at end of file
+admin.site.register(CartItem)
+
+# Orders are snapshots: viewable, not editable.
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    extra = 0
+    readonly_fields = ('variant', 'product_name', 'size', 'color', 'unit_price', 'quantity')
+    can_delete = False
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'item_count', 'total', 'created_at')
+    list_select_related = ('user',)
+    readonly_fields = ('user', 'idempotency_key', 'item_count', 'total', 'created_at')
+    inlines = [OrderLineInline]
@@ -0,0 +1,159 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse
+from django.urls import resolve
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.exceptions import APIException, NotAcceptable, NotAuthenticated, AuthenticationFailed, NotFound
+from rest_framework.renderers import JSONRenderer
+
+from .caching import async_cached_response
+from .carts import aget_cart, aget_guest_cart_id, aload_cart
+from .pagination import KeysetPagination
+from .tree import aget_category_tree
+from .views import CartViewSet, CategoryViewSet, ProductViewSet
+
+# Native async versions of the hottest read endpoints, mounted at the same URLs under ASGI
+# (ASGI_URLCONF). The viewsets still build the querysets, paginators and serializers; only
+# the waiting (cache, database) is awaited, so the JSON is byte-for-byte the same. Anything
+# they don't cover natively (other methods, the browsable API) runs the sync viewset.
+
+
+@sync_and_async_middleware
+def asgi_routing_middleware(get_response):
+    # ASGI requests resolve through ASGI_URLCONF, where the async views are mounted first
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.urlconf = settings.ASGI_URLCONF
+            return await get_response(request)
+        return middleware
+    return get_response
+
+
+def render_json(data, status=200):
+    # exactly what the viewsets' JSONRenderer writes
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error_response(view, exc):
+    # the parts of DRF's exception handler these views can hit
+    if isinstance(exc, Http404):
+        exc = NotFound(*exc.args)
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = render_json(data, exc.status_code)
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        response['WWW-Authenticate'] = view.get_authenticate_header(view.request)
+    return response
+
+
+def bind_viewset(viewset_class, actions, request, kwargs):
+    view = viewset_class(action_map=actions, args=(), kwargs=kwargs, format_kwarg=None, headers={})
+    view.request = view.initialize_request(request, **kwargs)
+    return view
+
+
+def renders_json(view):
+    if view.request.method not in ('GET', 'HEAD'):
+        return False
+    try:
+        renderer, media_type = view.perform_content_negotiation(view.request)
+    except NotAcceptable:
+        return False
+    view.request.accepted_renderer, view.request.accepted_media_type = renderer, media_type
+    return renderer.format == 'json'
+
+
+async def authenticate(view):
+    # without credentials there is nothing to look up; with them, the viewset's own authenticators run
+    if 'HTTP_AUTHORIZATION' not in view.request.META:
+        return view.request.user
+    return await sync_to_async(getattr)(view.request, 'user')
+
+
+def async_viewset_view(viewset_class, actions, cached=False):
+    """
+    Turn `handler(request, view, **kwargs)` into an async view for JSON GETs on a bound
+    `viewset_class` instance, falling back to the sync view routed at the same URL otherwise.
+    With `cached`, responses share CachedResponseMixin's ETags and cache entries.
+    """
+    def decorator(handler):
+        native = async_cached_response(handler) if cached else handler
+
+        async def view_func(request, **kwargs):
+            view = bind_viewset(viewset_class, actions, request, kwargs)
+            if not renders_json(view):
+                match = resolve(request.path_info, urlconf=settings.ROOT_URLCONF)
+                return await sync_to_async(match.func)(request, *match.args, **match.kwargs)
+            try:
+                return await native(request, view, **kwargs)
+            except (APIException, Http404) as exc:
+                return error_response(view, exc)
+        view_func.__name__ = handler.__name__
+        view_func.csrf_exempt = True
+        return view_func
+    return decorator
+
+
+async def apaginate_page_number(paginator, queryset, request):
+    # PageNumberPagination.paginate_queryset with the COUNT and the page fetched by the async ORM
+    paginator.request = request
+    page_size = paginator.get_page_size(request)
+    if not page_size:
+        return None
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    django_paginator.count = await queryset.acount()
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.page.object_list = [row async for row in paginator.page.object_list]
+    return paginator.page.object_list
+
+
+@async_viewset_view(ProductViewSet, {'get': 'list'}, cached=True)
+async def product_list(request, view):
+    await authenticate(view)
+    queryset = view.filter_queryset(view.get_queryset())
+    paginator = view.paginator
+    if paginator is None:
+        return render_json(view.get_serializer([row async for row in queryset], many=True).data)
+    if isinstance(paginator, KeysetPagination):
+        page = await paginator.apaginate_queryset(queryset, view.request, view)
+    else:
+        page = await apaginate_page_number(paginator, queryset, view.request)
+    return render_json(paginator.get_paginated_response(view.get_serializer(page, many=True).data).data)
+
+
+@async_viewset_view(ProductViewSet, {'get': 'retrieve'}, cached=True)
+async def product_detail(request, view, pk):
+    await authenticate(view)
+    queryset = view.filter_queryset(view.get_queryset())
+    try:
+        product = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+    except (TypeError, ValueError, DjangoValidationError):
+        raise Http404
+    return render_json(view.get_serializer(product).data)
+
+
+@async_viewset_view(CategoryViewSet, {'get': 'tree'}, cached=True)
+async def category_tree(request, view):
+    await authenticate(view)
+    return render_json(await aget_category_tree())
+
+
+@async_viewset_view(CartViewSet, {'get': 'retrieve', 'delete': 'destroy'})
+async def cart_detail(request, view):
+    user = await authenticate(view)
+    if user.is_authenticated:
+        cart = await aget_cart(user)
+    else:
+        token = view.get_cart_token()
+        cart_id = await aget_guest_cart_id(token) if token else None
+        cart = await aload_cart(cart_id) if cart_id else None
+    if cart is None:
+        return render_json(view.empty_cart)
+    return render_json(view.get_serializer(cart).data)
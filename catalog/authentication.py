@@ -0,0 +1,114 @@
+import time
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .caching import bump_version, get_catalog_version
+from .models import RevokedToken
+
+
+# --- Denylist -----------------------------------------------------------------
+#
+# Stateless tokens stay valid until they expire, so revocation is a RevokedToken row per
+# revoked token (by jti) or per user (everything issued before a moment), each kept only
+# as long as a token it could match may still be alive.
+#
+# Requests don't query the table: each worker keeps the unexpired rows in memory and reloads
+# them (one query) when the denylist version in the cache moves, which every revocation does
+# once it is committed, or when the key is gone from the cache. A worker that can't see the
+# others' bumps (a per-process cache) still reloads every JWT_DENYLIST_REFRESH_SECONDS.
+
+DENYLIST_VERSION_KEY = 'catalog:jwt-denylist-version'
+DEFAULT_DENYLIST_REFRESH_SECONDS = 30
+
+_denylist = {'version': None, 'loaded_at': 0.0, 'entries': {}}
+
+def denied_token_key(jti):
+    return f'jti:{jti}'
+
+
+def denied_user_key(user_id):
+    return f'user:{user_id}'
+
+
+def deny(key, expires_at):
+    RevokedToken.objects.update_or_create(key=key, defaults={'revoked_at': timezone.now(), 'expires_at': expires_at})
+    transaction.on_commit(lambda: bump_version(DENYLIST_VERSION_KEY))
+
+
+def denylist_refresh():
+    return getattr(settings, 'JWT_DENYLIST_REFRESH_SECONDS', DEFAULT_DENYLIST_REFRESH_SECONDS)
+
+
+def denied_entries():
+    """This worker's copy of the unexpired denylist, {key: (revoked_at, expires_at)}."""
+    version = get_catalog_version(DENYLIST_VERSION_KEY)  # seeded afresh if evicted, which forces a reload
+    now = time.monotonic()
+    if version != _denylist['version'] or now - _denylist['loaded_at'] > denylist_refresh():
+        rows = RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('key', 'revoked_at', 'expires_at')
+        _denylist.update(version=version, loaded_at=now,
+                         entries={key: (revoked_at, expires_at) for key, revoked_at, expires_at in rows})
+    return _denylist['entries']
+
+
+def revoke_token(token):
+    # Log out one access token (e.g. request.auth).
+    deny(denied_token_key(token[api_settings.JTI_CLAIM]), datetime_from_epoch(token['exp']))
+
+
+def revoke_user(user_id):
+    # Every token the user got so far: deactivation, deletion, "log out everywhere".
+    deny(denied_user_key(user_id), timezone.now() + api_settings.ACCESS_TOKEN_LIFETIME + timedelta(minutes=1))
+
+
+def is_revoked(token):
+    entries, now = denied_entries(), timezone.now()
+    token_entry = entries.get(denied_token_key(token.get(api_settings.JTI_CLAIM)))
+    if token_entry and token_entry[1] > now:
+        return True
+    user_entry = entries.get(denied_user_key(token.get(api_settings.USER_ID_CLAIM)))
+    return bool(user_entry) and user_entry[1] > now and token.get('iat', 0) <= user_entry[0].timestamp()
+
+
+def purge_revoked_tokens():
+    """Delete the denylist rows whose tokens have expired anyway. Returns how many."""
+    return RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+# --- Users ----------------------------------------------------------------------
+
+@lru_cache(maxsize=1024)
+def load_user(user_id):
+    """The User row behind a token, for the few paths that need more than its id."""
+    return User.objects.get(pk=user_id)
+
+
+class ShopperTokenUser(TokenUser):
+    # request.user for stateless requests; `.user` loads (and keeps) the real row on demand.
+
+    @cached_property
+    def user(self):
+        return load_user(self.id)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    JWT authentication without the per-request User SELECT: request.user is built from
+    the token's claims, and revoked tokens are turned away by the in-memory denylist instead.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if is_revoked(validated_token):
+            raise AuthenticationFailed('Token has been revoked.', code='token_revoked')
+        return ShopperTokenUser(user.token)
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from .db import is_pinned_to_primary, pin_timeout, primary_reads
+
+
+def query_cache_key(prefix, request, ignore=()):
+    """
+    Cache key for a request's normalized query parameters: order-insensitive,
+    and blind to parameters (pagination, flags) that don't change the result.
+    """
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists() if key not in ignore)
+    digest = hashlib.md5(json.dumps([request.path, params]).encode()).hexdigest()
+    return f'{prefix}:{digest}'
+
+
+# Catalogue-wide version: part of every cached response key and ETag, bumped on any catalogue write,
+# so stale entries are never read again and simply age out of the cache.
+CATALOG_VERSION_KEY = 'catalog:version'
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+# Set for the replica lag window (DATABASE_REPLICA_PIN_SECONDS) after every bump: entries filled meanwhile are read
+# from the primary, so a replica that hasn't caught up yet can't be cached under the new version.
+CATALOG_RECENT_BUMP_KEY = 'catalog:version-recent'
+# Bumped on every stock movement done through update() (holds, releases, checkouts). Only responses that
+# show per-variant stock (see CachedResponseMixin.shows_stock) include it, so a cart add leaves the compact
+# listings and the categories cached.
+CATALOG_STOCK_VERSION_KEY = 'catalog:stock-version'
+
+
+def get_catalog_version(key=CATALOG_VERSION_KEY):
+    version = cache.get(key)
+    if version is None:
+        # seeded from the clock so a cache flush never hands out an ETag a client already holds
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_catalog_version(key=CATALOG_VERSION_KEY):
+    bump_version(key)
+    if getattr(settings, 'DATABASE_REPLICAS', ()):
+        cache.set(CATALOG_RECENT_BUMP_KEY, 1, pin_timeout())
+
+
+def bump_stock_version():
+    bump_catalog_version(CATALOG_STOCK_VERSION_KEY)
+
+
+def fill_reads():
+    # where a cache miss is rendered from: the primary right after a bump, else wherever the router says
+    recent = getattr(settings, 'DATABASE_REPLICAS', ()) and cache.get(CATALOG_RECENT_BUMP_KEY)
+    return primary_reads() if recent else nullcontext()
+
+
+async def afill_reads():
+    recent = getattr(settings, 'DATABASE_REPLICAS', ()) and await cache.aget(CATALOG_RECENT_BUMP_KEY)
+    return primary_reads() if recent else nullcontext()
+
+
+async def aget_catalog_version(key=CATALOG_VERSION_KEY):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def response_fingerprint(request, versions):
+    # (ETag, cache key) for a catalogue GET: the versions, scheme and host (bodies hold absolute links),
+    # path, normalized query and Accept header
+    fingerprint = hashlib.md5(json.dumps([
+        versions,
+        request.scheme,
+        request.get_host(),
+        request.path,
+        sorted((key, sorted(values)) for key, values in request.GET.lists()),
+        request.META.get('HTTP_ACCEPT', ''),
+    ]).encode()).hexdigest()
+    return f'"{fingerprint}"', f'catalog:response:{fingerprint}'
+
+
+def is_not_modified(request, etag):
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return etag in if_none_match or '*' in if_none_match
+
+
+def finish_cached_response(response, etag, max_age):
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age, must_revalidate=True)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class CachedResponseMixin:
+    """
+    Whole-response caching with strong ETags for read-only, public viewsets.
+
+    The ETag is derived from the catalogue version and the normalized request, so a
+    matching If-None-Match is answered with 304 before DRF authenticates, builds a
+    queryset or serializes anything. Otherwise a cached body is replayed, or the
+    view runs once and its JSON output is stored. Works with any cache backend
+    (local-memory, file, ...) since only bytes and a content type are stored.
+    """
+    cache_max_age = 0 # clients always revalidate; a 304 costs no database work
+
+    def shows_stock(self, request, action):
+        # True when the action's payload embeds live stock levels, which change without a catalogue bump
+        return False
+
+    def response_versions(self, request):
+        versions = [get_catalog_version()]
+        if self.shows_stock(request, self.action_map.get('get')):
+            versions.append(get_catalog_version(CATALOG_STOCK_VERSION_KEY))
+        return versions
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        etag, cache_key = response_fingerprint(request, self.response_versions(request))
+        if is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            # a shopper pinned to the primary skips entries a lagging replica may have filled, and refreshes them
+            cached = None if is_pinned_to_primary() else cache.get(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                with fill_reads():
+                    response = super().dispatch(request, *args, **kwargs)
+                renderer = getattr(response, 'accepted_renderer', None)
+                # only plain JSON 200s; the browsable API embeds per-user markup
+                if response.status_code != 200 or renderer is None or renderer.format != 'json':
+                    return response
+                response.render()
+                cache.set(cache_key, (response.content, response['Content-Type']), RESPONSE_CACHE_TIMEOUT)
+
+        return finish_cached_response(response, etag, self.cache_max_age)
+
+
+def async_cached_response(view):
+    """
+    CachedResponseMixin for native async views that return rendered JSON: same ETags and
+    cache entries as the sync viewsets, so both serve (and revalidate) each other's responses.
+    """
+    @wraps(view)
+    async def wrapper(request, viewset, *args, **kwargs):
+        versions = [await aget_catalog_version()]
+        if viewset.shows_stock(request, viewset.action):
+            versions.append(await aget_catalog_version(CATALOG_STOCK_VERSION_KEY))
+        etag, cache_key = response_fingerprint(request, versions)
+        if is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            cached = None if is_pinned_to_primary() else await cache.aget(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                with await afill_reads():
+                    response = await view(request, viewset, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                await cache.aset(cache_key, (response.content, response['Content-Type']), RESPONSE_CACHE_TIMEOUT)
+        return finish_cached_response(response, etag, CachedResponseMixin.cache_max_age)
+    return wrapper
@@ -0,0 +1,199 @@
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .db import retry_on_busy
+from .models import Cart, CartItem
+from .reservations import hold_cart_lines, release_cart_lines
+
+# A cart never changes owner, so the owner -> id mapping can stay cached for long;
+# deleting the cart drops the entry (see signals).
+CART_ID_TIMEOUT = 60 * 60 * 24
+
+# Days a guest cart survives without changes before sweep_guest_carts() removes it.
+DEFAULT_GUEST_CART_DAYS = 30
+
+
+def cart_id_key(user_id):
+    return f'catalog:cart-id:{user_id}'
+
+
+def guest_cart_key(token):
+    return f'catalog:guest-cart:{token}'
+
+
+def get_cart_id(user):
+    """The user's cart id, created on first use. No query once cached."""
+    key = cart_id_key(user.pk)
+    cart_id = cache.get(key)
+    if cart_id is None:
+        cart_id = Cart.objects.get_or_create(user_id=user.pk)[0].pk
+        cache.set(key, cart_id, CART_ID_TIMEOUT)
+    return cart_id
+
+
+def get_guest_cart_id(token):
+    """Id of the guest cart named by `token`, or None."""
+    key = guest_cart_key(token)
+    cart_id = cache.get(key)
+    if cart_id is None:
+        cart_id = Cart.objects.filter(guest_token=token).values_list('pk', flat=True).first()
+        if cart_id is not None:
+            cache.set(key, cart_id, CART_ID_TIMEOUT)
+    return cart_id
+
+
+def create_guest_cart():
+    # 16 random bytes -> 22 url-safe characters; the row holds nothing else about the guest
+    token = secrets.token_urlsafe(16)
+    cart_id = Cart.objects.create(guest_token=token).pk
+    cache.set(guest_cart_key(token), cart_id, CART_ID_TIMEOUT)
+    return token, cart_id
+
+
+def forget_cart_id(cart):
+    if cart.user_id is not None:
+        cache.delete(cart_id_key(cart.user_id))
+    if cart.guest_token:
+        cache.delete(guest_cart_key(cart.guest_token))
+
+
+def cart_with_items():
+    # Everything CartSerializer reads, in two queries: the cart (+ user) and its lines (+ variant + product).
+    return Cart.objects.select_related('user').prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('variant__product').order_by('pk'))
+    )
+
+
+def load_cart(cart_id):
+    """The cart with its lines, variants and products loaded, in a fixed number of queries."""
+    return cart_with_items().filter(pk=cart_id).first()
+
+
+def get_cart(user):
+    cart = load_cart(get_cart_id(user))
+    if cart is None:
+        # cached id of a cart deleted behind our back (e.g. another process, no shared cache)
+        cache.delete(cart_id_key(user.pk))
+        cart = load_cart(get_cart_id(user))
+    return cart
+
+
+# Async counterparts for the native async cart view (catalog.async_views), same cache entries.
+
+async def aget_cart_id(user):
+    key = cart_id_key(user.pk)
+    cart_id = await cache.aget(key)
+    if cart_id is None:
+        cart_id = (await Cart.objects.aget_or_create(user_id=user.pk))[0].pk
+        await cache.aset(key, cart_id, CART_ID_TIMEOUT)
+    return cart_id
+
+
+async def aget_guest_cart_id(token):
+    key = guest_cart_key(token)
+    cart_id = await cache.aget(key)
+    if cart_id is None:
+        cart_id = await Cart.objects.filter(guest_token=token).values_list('pk', flat=True).afirst()
+        if cart_id is not None:
+            await cache.aset(key, cart_id, CART_ID_TIMEOUT)
+    return cart_id
+
+
+async def aload_cart(cart_id):
+    return await cart_with_items().filter(pk=cart_id).afirst()
+
+
+async def aget_cart(user):
+    cart = await aload_cart(await aget_cart_id(user))
+    if cart is None:
+        await cache.adelete(cart_id_key(user.pk))
+        cart = await aload_cart(await aget_cart_id(user))
+    return cart
+
+
+@retry_on_busy
+def merge_carts(source_cart_id, target_cart_id):
+    """
+    Move every line of a guest cart into another cart and delete the guest cart, in one
+    transaction: the guest's holds are released and the combined quantities held again
+    with hold_cart_lines(), so stock is reconciled in a few set-based statements. A line
+    that no longer fits is capped at what is still available.
+    Returns {variant_id: available} for the lines that couldn't be carried over in full.
+    """
+    with transaction.atomic():
+        # lock the guest cart first: a concurrent merge of the same cart waits here and then finds it gone
+        if not Cart.objects.select_for_update().filter(pk=source_cart_id, user=None).exists():
+            return {}
+        lines = CartItem.objects.filter(cart_id=source_cart_id)
+        quantities = dict(lines.values_list('variant_id', 'quantity'))
+        release_cart_lines(lines, delete=True)
+
+        failures = hold_cart_lines(target_cart_id, quantities, partial=True)
+        leftovers = {variant_id: available for variant_id, available in failures.items() if available}
+        if leftovers:
+            hold_cart_lines(target_cart_id, leftovers, partial=True)
+        Cart.objects.filter(pk=source_cart_id).delete()
+    return failures
+
+
+def merge_guest_cart(token, user):
+    # Called at login (and by POST /api/cart/merge/) with the guest's X-Cart-Token.
+    guest_cart_id = get_guest_cart_id(token)
+    if guest_cart_id is None:
+        return {}
+    return merge_carts(guest_cart_id, get_cart_id(user))
+
+
+@retry_on_busy
+def sweep_guest_carts(now=None, limit=500):
+    """
+    Delete guest carts untouched for CART_GUEST_DAYS, giving their holds back in bulk,
+    at most `limit` carts per call. Returns the number of carts deleted.
+    """
+    days = getattr(settings, 'CART_GUEST_DAYS', DEFAULT_GUEST_CART_DAYS)
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    with transaction.atomic():
+        stale = list(Cart.objects.filter(user=None, updated_at__lt=cutoff).order_by('pk').values_list('pk', flat=True)[:limit])
+        if not stale:
+            return 0
+        release_cart_lines(CartItem.objects.filter(cart_id__in=stale), delete=True)
+        Cart.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+class CartOwnerMixin:
+    """
+    Resolves the requesting shopper's cart: the user's own when authenticated, otherwise
+    the guest cart named by the X-Cart-Token header. A guest without a usable token gets
+    a new cart on their first write, and its token back in the same response header.
+    """
+    cart_token_header = 'X-Cart-Token'
+    issued_cart_token = None
+
+    def get_cart_token(self):
+        return self.request.headers.get(self.cart_token_header)
+
+    def get_cart_id(self, create=True):
+        user = self.request.user
+        if user.is_authenticated:
+            return get_cart_id(user)
+        token = self.get_cart_token()
+        cart_id = get_guest_cart_id(token) if token else None
+        if cart_id is None and create:
+            self.issued_cart_token, cart_id = create_guest_cart()
+        return cart_id
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.issued_cart_token and response.status_code >= 400:
+            # the write that needed it failed: don't leave an empty cart (and a token) behind
+            Cart.objects.filter(guest_token=self.issued_cart_token).delete()
+        elif self.issued_cart_token:
+            response[self.cart_token_header] = self.issued_cart_token
+        return response
@@ -0,0 +1,199 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Lock contention the whole transaction can simply be re-run for: SQLite's SQLITE_BUSY/SQLITE_LOCKED,
+# and Postgres deadlock / serialization victims.
+RETRYABLE_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'deadlock detected',
+    'could not serialize access',
+)
+
+
+def is_retryable(exc):
+    message = str(exc)
+    return any(text in message for text in RETRYABLE_MESSAGES)
+
+
+def retry_on_busy(func):
+    """
+    Re-run a write transaction that lost a lock race, up to SQLITE_BUSY_RETRIES times
+    with jittered exponential backoff. Only the outermost call retries: inside an
+    enclosing transaction the error propagates so the caller's whole unit is re-run.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connection.in_atomic_block:
+            return func(*args, **kwargs)
+        retries = getattr(settings, 'SQLITE_BUSY_RETRIES', 3)
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if attempt == retries or not is_retryable(exc):
+                    raise
+                time.sleep(random.uniform(0, 0.02 * 2 ** attempt))
+    return wrapper
+
+
+# --- Read replicas ------------------------------------------------------------
+#
+# Catalogue reads go to DATABASE_REPLICAS, everything else to the primary. A shopper who
+# just changed their cart (or placed an order) is pinned to the primary for
+# DATABASE_REPLICA_PIN_SECONDS so they never see stock from before their own write.
+
+DEFAULT_REPLICA_PIN_SECONDS = 5
+
+# Per-request {'pinned': bool, 'wrote': bool}, set by ReplicaPinningMiddleware; None outside requests.
+_request_state = ContextVar('catalog_replica_state', default=None)
+
+
+def replica_pin_key(owner):
+    return f'catalog:db-pinned:{owner}'
+
+
+def user_owner(user_id):
+    return f'user:{user_id}'
+
+
+def cart_owner(cart_token):
+    return f'cart:{cart_token}'
+
+
+def request_owners(request, response=None):
+    """Who the request acts for: the token's user and/or the guest cart token."""
+    owners = []
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        try:
+            owners.append(user_owner(AccessToken(header[7:])[api_settings.USER_ID_CLAIM]))
+        except (TokenError, KeyError):
+            pass
+    for cart_token in (request.headers.get('X-Cart-Token'), response and response.get('X-Cart-Token')):
+        if cart_token:
+            owners.append(cart_owner(cart_token))
+    return owners
+
+
+def pin_timeout():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', DEFAULT_REPLICA_PIN_SECONDS)
+
+
+def pin_to_primary(owners):
+    cache.set_many({replica_pin_key(owner): 1 for owner in owners}, pin_timeout())
+
+
+async def apin_to_primary(owners):
+    await cache.aset_many({replica_pin_key(owner): 1 for owner in owners}, pin_timeout())
+
+
+def is_pinned_to_primary():
+    state = _request_state.get()
+    return state is not None and (state['pinned'] or state['wrote'])
+
+
+@contextmanager
+def primary_reads():
+    # catalogue reads in this block go to the primary, whoever the request is for
+    state = _request_state.get()
+    if state is None:
+        reset_token = _request_state.set({'pinned': True, 'wrote': False})
+        try:
+            yield
+        finally:
+            _request_state.reset(reset_token)
+        return
+    pinned, state['pinned'] = state['pinned'], True
+    try:
+        yield
+    finally:
+        state['pinned'] = pinned
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of the catalogue models to a random replica, unless the request is pinned
+    to the primary or runs inside a transaction on it (locking reads, read-modify-write).
+    Without DATABASE_REPLICAS every query stays on the primary.
+    """
+    replica_models = {'category', 'product', 'productvariant', 'productimage'}
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        if not replicas or model._meta.app_label != 'catalog' or model._meta.model_name not in self.replica_models:
+            return None
+        if is_pinned_to_primary() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True  # later reads in this request see the write
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # replicas hold the same rows
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+class ReplicaPinningMiddleware:
+    """
+    Looks up whether the requesting shopper is pinned to the primary (one cache read),
+    and pins them when their request wrote anything. Runs natively under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'DATABASE_REPLICAS', ()):
+            return self.get_response(request)
+
+        owners = request_owners(request)
+        state = {'pinned': bool(owners) and bool(cache.get_many([replica_pin_key(owner) for owner in owners])),
+                 'wrote': False}
+        reset_token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(reset_token)
+        if state['wrote']:
+            pin_to_primary(request_owners(request, response))
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'DATABASE_REPLICAS', ()):
+            return await self.get_response(request)
+
+        owners = request_owners(request)
+        state = {'pinned': bool(owners) and bool(await cache.aget_many([replica_pin_key(owner) for owner in owners])),
+                 'wrote': False}
+        reset_token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(reset_token)
+        if state['wrote']:
+            await apin_to_primary(request_owners(request, response))
+        return response
@@ -0,0 +1,44 @@
+from django.db.models import Count, Q
+
+from .models import Product, ProductVariant
+
+# Lower bounds of the price buckets, on the product's "from" price (min_price); the last bucket is open-ended.
+PRICE_BUCKETS = (0, 25, 50, 100, 250, 500, 1000)
+
+
+def compute_facets(queryset):
+    """
+    Facet counts for an already filtered Product queryset, in four aggregate queries
+    (categories, sizes, colors, price buckets) regardless of how many values exist.
+    Counts are distinct products.
+    """
+    product_ids = queryset.order_by().values('pk')
+    products = Product.objects.filter(pk__in=product_ids)
+    variants = ProductVariant.objects.filter(product__in=product_ids)
+
+    categories = (
+        products.values('category_id', 'category__slug', 'category__full_name')
+        .annotate(count=Count('id'))
+        .order_by('category__path')
+    )
+    sizes = variants.values('size').annotate(count=Count('product', distinct=True)).order_by('size')
+    colors = variants.values('color').annotate(count=Count('product', distinct=True)).order_by('color')
+
+    bounds = list(zip(PRICE_BUCKETS, PRICE_BUCKETS[1:] + (None,)))
+    buckets = products.aggregate(**{
+        f'bucket_{index}': Count('id', filter=Q(min_price__gte=low, **({'min_price__lt': high} if high is not None else {})))
+        for index, (low, high) in enumerate(bounds)
+    })
+
+    return {
+        'categories': [
+            {'id': row['category_id'], 'slug': row['category__slug'], 'name': row['category__full_name'], 'count': row['count']}
+            for row in categories
+        ],
+        'sizes': [{'value': row['size'], 'count': row['count']} for row in sizes],
+        'colors': [{'value': row['color'], 'count': row['count']} for row in colors],
+        'price': [
+            {'min': low, 'max': high, 'count': buckets[f'bucket_{index}']}
+            for index, (low, high) in enumerate(bounds)
+        ],
+    }
@@ -0,0 +1,118 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models.manager import BaseManager
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import RelatedField
+
+
+def identity(value):
+    return value
+
+
+def is_model_path(model, attrs):
+    # True when every hop of a dotted source is a real field/relation (never a callable DRF would invoke).
+    for position, attr in enumerate(attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return False
+        if model_field.auto_created and not model_field.concrete and model_field.get_accessor_name() != attr:
+            return False
+        model = model_field.related_model
+        if model is None and position < len(attrs) - 1:
+            return False
+    return True
+
+
+def compile_getter(field, model):
+    if not field.source_attrs:  # source='*'
+        return identity
+    if model is None or not is_model_path(model, field.source_attrs):
+        return field.get_attribute
+    fast = attrgetter('.'.join(field.source_attrs))
+
+    def get(instance):
+        try:
+            return fast(instance)
+        except (AttributeError, ObjectDoesNotExist):
+            # defaults, missing relations and SkipField handled exactly as DRF does
+            return field.get_attribute(instance)
+    return get
+
+
+def compile_converter(field):
+    if isinstance(field, serializers.ListSerializer):
+        child = compile_serializer(field.child)
+        return lambda data: [child(item) for item in (data.all() if isinstance(data, BaseManager) else data)]
+    if isinstance(field, serializers.BaseSerializer):
+        return compile_serializer(field)
+    if isinstance(field, serializers.SerializerMethodField):
+        return getattr(field.parent, field.method_name)
+    if isinstance(field, RelatedField) and field.use_pk_only_optimization():
+        return lambda value: None if value.pk is None else field.to_representation(value)
+    to_representation = type(field).to_representation
+    if to_representation is serializers.CharField.to_representation:
+        return str
+    if to_representation is serializers.IntegerField.to_representation:
+        return int
+    return field.to_representation
+
+
+def compile_serializer(serializer):
+    """
+    Turn a bound, read-only serializer into a plain `instance -> dict` function.
+
+    Field lookups, source traversal and type dispatch are resolved once per
+    response instead of once per field per row; every value still goes through
+    the same to_representation logic, so the rendered JSON is byte-identical.
+    """
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    steps = [
+        (field.field_name, compile_getter(field, model), compile_converter(field))
+        for field in serializer._readable_fields
+    ]
+
+    def represent(instance):
+        ret = {}
+        for name, get, convert in steps:
+            try:
+                value = get(instance)
+            except SkipField:
+                continue
+            ret[name] = None if value is None else convert(value)
+        return ret
+    return represent
+
+
+class FastSerializer:
+    # Read-only stand-in for a configured DRF serializer, exposing the same `.data`.
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    @property
+    def data(self):
+        serializer = self.serializer
+        if isinstance(serializer, serializers.ListSerializer):
+            represent = compile_serializer(serializer.child)
+            instance = serializer.instance
+            iterable = instance.all() if isinstance(instance, BaseManager) else instance
+            return [represent(item) for item in iterable]
+        return compile_serializer(serializer)(serializer.instance)
+
+
+class FastSerializationMixin:
+    """
+    Serve the listed read-only actions through FastSerializer.
+    Switch off globally with CATALOG_FAST_SERIALIZATION = False.
+    """
+    fast_serialization_actions = ()
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.action in self.fast_serialization_actions and getattr(settings, 'CATALOG_FAST_SERIALIZATION', True):
+            return FastSerializer(serializer)
+        return serializer
@@ -0,0 +1,57 @@
+import django_filters
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .models import Category, Product
+from .search import search_backend
+
+
+class ProductFilter(django_filters.FilterSet):
+    # ?category=clothing matches products in clothing and every subcategory below it
+    category = django_filters.CharFilter(method='filter_category_subtree', label='Category slug (includes subcategories)')
+
+    # Price range runs on the denormalized columns, no join on ProductVariant.
+    # "some variant costs >= x" is max_price >= x, "some variant costs <= y" is min_price <= y.
+    variants__price__gte = django_filters.NumberFilter(field_name='max_price', lookup_expr='gte')
+    variants__price__lte = django_filters.NumberFilter(field_name='min_price', lookup_expr='lte')
+
+    class Meta:
+        model = Product
+        fields = {
+            'category__slug': ['exact'],
+            'in_stock': ['exact'],
+        }
+
+    def filter_category_subtree(self, queryset, name, value):
+        # single IN (...) over an indexed path range, no recursive walk; lazy, so async views can use it too
+        return queryset.filter(category__in=Category.objects.descendants_of_slug(value))
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    # ?search=<terms> through the configured index backend (FTS5 / tsvector), last word prefix-matched.
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return search_backend.search(queryset, term)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    # Old ?ordering=variants__price requests are served from the denormalized columns.
+    legacy_ordering = {
+        'variants__price': 'min_price',
+        '-variants__price': '-max_price',
+    }
+
+    def get_default_ordering(self, view):
+        # best matches first when searching without an explicit ?ordering=
+        if view.request.query_params.get(ProductSearchFilter.search_param, '').strip():
+            return ['-search_rank']
+        return super().get_default_ordering(view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [self.legacy_ordering.get(field, field) for field in ordering]
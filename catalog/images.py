@@ -0,0 +1,229 @@
+import io
+import logging
+import os
+import posixpath
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .caching import bump_catalog_version
+from .models import ProductImage
+from .storage import product_image_storage
+
+logger = logging.getLogger(__name__)
+
+# Resized copies of every product image, generated off the request path (see schedule_derivatives()).
+# Formats are listed by preference: the first one is what single-URL fields such as thumbnails use.
+DEFAULT_IMAGE_WIDTHS = (160, 320, 640, 1280)
+DEFAULT_IMAGE_FORMATS = ('webp', 'jpeg')
+DEFAULT_IMAGE_QUALITY = 80
+DEFAULT_IMAGE_WORKERS = 2
+DEFAULT_THUMBNAIL_WIDTH = 320
+# A stored file that was (re)uploaded this recently is never deleted on release, only by
+# compact_product_images: an identical upload may be about to reference it.
+DEFAULT_BLOB_GRACE_SECONDS = 10 * 60
+
+DERIVED_DIR = 'derived'
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def image_widths():
+    return sorted(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', DEFAULT_IMAGE_WIDTHS))
+
+
+def image_formats():
+    return tuple(getattr(settings, 'PRODUCT_IMAGE_FORMATS', DEFAULT_IMAGE_FORMATS))
+
+
+def image_quality():
+    return getattr(settings, 'PRODUCT_IMAGE_QUALITY', DEFAULT_IMAGE_QUALITY)
+
+
+def blob_grace_seconds():
+    return getattr(settings, 'PRODUCT_IMAGE_BLOB_GRACE_SECONDS', DEFAULT_BLOB_GRACE_SECONDS)
+
+
+def render_derivatives(data, widths, formats, quality):
+    """
+    Encode `data` (an image file's bytes) at every width narrower than the original, in every
+    format. Pure bytes in, bytes out, so it runs in a thread or a worker process alike.
+    Returns {format: {width: bytes}}.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        # JPEG sources decode straight at a reduced scale when only smaller sizes are needed
+        # (square bound: the EXIF rotation below may still swap width and height)
+        source.draft('RGB', (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    rendered = {name: {} for name in formats}
+    # largest first, each size resampled from the previous one: far less work than from the original every time
+    for width in sorted((width for width in widths if width < image.width), reverse=True):
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        for name in formats:
+            frame = image.convert('RGB') if name == 'jpeg' and image.mode != 'RGB' else image
+            buffer = io.BytesIO()
+            if name == 'jpeg':
+                frame.save(buffer, PIL_FORMATS[name], quality=quality, optimize=True, progressive=True)
+            else:
+                frame.save(buffer, PIL_FORMATS[name], quality=quality, method=4)
+            rendered[name][width] = buffer.getvalue()
+    return rendered
+
+
+def current_sizes(derivatives, image_name):
+    # {format: {width: path}} if the derivatives were made from `image_name` (not a replaced upload)
+    derivatives = derivatives or {}
+    return derivatives.get('sizes', {}) if image_name and derivatives.get('source') == image_name else {}
+
+
+def pick_derivative(derivatives, image_name, min_width):
+    """
+    Path of the smallest derivative of `image_name` at least `min_width` wide (else the widest
+    one), in the preferred format; None when it has none yet.
+    """
+    sizes = current_sizes(derivatives, image_name)
+    for name in image_formats():
+        by_width = sorted((int(width), path) for width, path in sizes.get(name, {}).items())
+        if by_width:
+            return next((path for width, path in by_width if width >= min_width), by_width[-1][1])
+    return None
+
+
+def derivative_name(source_name, width, name, quality=None):
+    # products/9f/9f86...08.jpg -> products/9f/derived/9f86...08-320w-q80.webp: everything that
+    # determines the bytes is in the name, so derivatives are as immutable as their original
+    directory, filename = posixpath.split(source_name)
+    stem = posixpath.splitext(filename)[0]
+    quality = image_quality() if quality is None else quality
+    return posixpath.join(directory, DERIVED_DIR, f'{stem}-{width}w-q{quality}.{EXTENSIONS[name]}')
+
+
+def derivative_paths(derivatives):
+    return {path for sizes in (derivatives or {}).get('sizes', {}).values() for path in sizes.values()}
+
+
+def delete_files(storage, paths):
+    for path in paths:
+        storage.delete(path)
+
+
+def save_file(storage, name, content):
+    # an existing file under a derivative's name already holds exactly these bytes
+    return storage.save(name, ContentFile(content))
+
+
+def store_derivatives(source_name, rendered):
+    """
+    Save rendered derivatives next to the original and record them on every row showing
+    it (identical uploads share one file), unless none is left; files no longer
+    referenced are removed. Returns True when recorded.
+    """
+    storage = product_image_storage()
+    derivatives = {
+        'source': source_name,
+        'sizes': {
+            name: {str(width): save_file(storage, derivative_name(source_name, width, name), content)
+                   for width, content in by_width.items()}
+            for name, by_width in rendered.items()
+        },
+    }
+    with transaction.atomic():
+        rows = ProductImage.objects.select_for_update().filter(image=source_name)
+        previous = list(rows.values_list('derivatives', flat=True))
+        if previous:
+            # e.g. sizes dropped from PRODUCT_IMAGE_WIDTHS, or another quality
+            obsolete = set().union(*(derivative_paths({'sizes': current_sizes(old, source_name)})
+                                     for old in previous)) - derivative_paths(derivatives)
+            rows.update(derivatives=derivatives)  # no signals: nothing to redo
+            transaction.on_commit(bump_catalog_version)  # cached payloads carry the new srcset
+        else:
+            obsolete = derivative_paths(derivatives)  # rendered for an image that is gone or was replaced
+    delete_files(storage, obsolete)
+    return bool(previous)
+
+
+def generate_derivatives(image_id):
+    """Render and store the derivatives of one ProductImage in this thread."""
+    row = ProductImage.objects.filter(pk=image_id).values('image').first()
+    if row is None or not row['image']:
+        return False
+    name = row['image']
+    # the same file uploaded for another product: its sizes are already there
+    shared = (ProductImage.objects.filter(image=name, derivatives__source=name).exclude(pk=image_id)
+              .values_list('derivatives', flat=True).first())
+    if shared:
+        with transaction.atomic():
+            recorded = ProductImage.objects.filter(pk=image_id, image=name).update(derivatives=shared)
+            transaction.on_commit(bump_catalog_version)
+        return bool(recorded)
+    with product_image_storage().open(name, 'rb') as original:
+        data = original.read()
+    rendered = render_derivatives(data, image_widths(), image_formats(), image_quality())
+    return store_derivatives(name, rendered)
+
+
+def release_image(name, derivatives=None):
+    """
+    Delete the stored file `name` and its derivatives once no ProductImage references it
+    any more (reference counting over the rows naming it). Runs after the commit that
+    dropped a reference, e.g. a deleted or replaced image. Returns True when deleted.
+    """
+    if not name:
+        return False
+    storage = product_image_storage()
+    with transaction.atomic():  # on the primary, with writers held off while the files go
+        if ProductImage.objects.filter(image=name).exists():
+            return False
+        try:
+            if time.time() - os.path.getmtime(storage.path(name)) < blob_grace_seconds():
+                return False
+        except FileNotFoundError:
+            pass
+        paths = derivative_paths({'sizes': current_sizes(derivatives, name)})
+        paths |= {derivative_name(name, width, fmt) for width in image_widths() for fmt in image_formats()}
+        delete_files(storage, paths | {name})
+    return True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def image_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'PRODUCT_IMAGE_WORKERS', DEFAULT_IMAGE_WORKERS)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='product-images')
+    return _executor
+
+
+def _generate_in_background(image_id):
+    close_old_connections()
+    try:
+        generate_derivatives(image_id)
+    except Exception:
+        logger.exception('Could not generate derivatives for product image %s', image_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(image_id):
+    """
+    Generate the image's derivatives in the background pool once the upload is committed,
+    so the admin/API request returns right away (Pillow releases the GIL while resampling
+    and encoding). With PRODUCT_IMAGE_WORKERS = 0 they are generated inline at commit.
+    """
+    if getattr(settings, 'PRODUCT_IMAGE_WORKERS', DEFAULT_IMAGE_WORKERS):
+        transaction.on_commit(lambda: image_executor().submit(_generate_in_background, image_id))
+    else:
+        transaction.on_commit(lambda: generate_derivatives(image_id))
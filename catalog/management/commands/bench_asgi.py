@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from catalog.carts import create_guest_cart
+from catalog.models import Cart, Product, ProductVariant
+from catalog.reservations import hold_cart_line
+
+MODES = ('wsgi', 'asgi-sync', 'asgi-async')
+
+
+def rss_kb(field):
+    # VmRSS (current) or VmHWM (peak) of this process, in KiB
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the catalogue and cart reads in-process at several concurrency levels, as WSGI '
+            '(one thread per in-flight request), ASGI running the sync viewsets, and ASGI with the native '
+            'async views. Each run is a fresh process reporting requests/s and peak memory per in-flight '
+            'request. Uses the configured database; the guest cart it reads is deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500],
+                            help='In-flight requests (threads for WSGI, tasks for ASGI).')
+        parser.add_argument('--requests', type=int, default=3000, help='Requests per run.')
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--uncached', action='store_true',
+                            help='Run without the response cache, so every request reaches the database.')
+        parser.add_argument('--worker', choices=MODES, help=argparse.SUPPRESS)
+        parser.add_argument('--cart-token', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.run_worker(options)
+
+        product = Product.objects.filter(is_active=True).order_by('pk').first()
+        variant = ProductVariant.objects.filter(stock_quantity__gt=0).order_by('pk').first()
+        if product is None or variant is None:
+            raise CommandError('No products to read; run seed_data first.')
+        token, cart_id = create_guest_cart()
+        try:
+            hold_cart_line(cart_id, variant.pk, 1)
+            self.stdout.write(f'{"mode":<11} {"in-flight":>9} {"req/s":>9} {"peak RSS":>10} {"KiB/in-flight":>14} {"errors":>7}')
+            for concurrency in options['concurrency']:
+                for mode in options['modes']:
+                    result = self.spawn(mode, concurrency, token, options)
+                    self.stdout.write(f'{mode:<11} {concurrency:>9} {result["rps"]:>9.1f} '
+                                      f'{result["peak_kb"] / 1024:>8.1f}MB {result["kb_per_request"]:>14.1f} '
+                                      f'{result["errors"]:>7}')
+        finally:
+            Cart.objects.filter(pk=cart_id).delete()  # releases the hold (signals)
+
+    def spawn(self, mode, concurrency, token, options):
+        command = [sys.executable, sys.argv[0], 'bench_asgi', '--worker', mode, '--concurrency', str(concurrency),
+                   '--requests', str(options['requests']), '--cart-token', token]
+        if options['uncached']:
+            command.append('--uncached')
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    # --- worker process -----------------------------------------------------------
+
+    def run_worker(self, options):
+        overrides = {}
+        if options['uncached']:
+            overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        if options['worker'] == 'asgi-sync':
+            overrides['ASGI_URLCONF'] = settings.ROOT_URLCONF  # every view through sync_to_async, as before
+        with override_settings(**overrides):
+            product_id = Product.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True).first()
+            requests = [
+                ('/api/products/', {}),
+                (f'/api/products/{product_id}/', {}),
+                ('/api/categories/tree/', {}),
+                ('/api/cart/', {'X-Cart-Token': options['cart_token']}),
+            ]
+            run = self.run_wsgi if options['worker'] == 'wsgi' else self.run_asgi
+            run(requests, 50, 10)  # warm up connections, caches and imports
+            baseline = rss_kb('VmRSS')
+            concurrency = options['concurrency'][0]
+            started = time.perf_counter()
+            errors = run(requests, options['requests'], concurrency)
+            elapsed = time.perf_counter() - started
+            peak = rss_kb('VmHWM')
+        self.stdout.write(json.dumps({
+            'rps': options['requests'] / elapsed,
+            'peak_kb': peak,
+            'kb_per_request': max(peak - baseline, 0) / concurrency,
+            'errors': errors,
+        }))
+
+    def run_wsgi(self, requests, total, concurrency):
+        application = get_wsgi_application()
+        counter, errors, lock = iter(range(total)), [0], threading.Lock()
+
+        def client():
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                path, headers = requests[index % len(requests)]
+                status = []
+                body = application(self.wsgi_environ(path, headers), lambda code, _headers: status.append(code))
+                b''.join(body)
+                body.close()
+                if not status[0].startswith('200'):
+                    with lock:
+                        errors[0] += 1
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(client)
+        return errors[0]
+
+    @staticmethod
+    def wsgi_environ(path, headers):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        }
+        environ.update({'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()})
+        return environ
+
+    def run_asgi(self, requests, total, concurrency):
+        application = get_asgi_application()
+        counter, errors = iter(range(total)), [0]
+
+        async def request(path, headers):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+                'headers': [(b'host', b'localhost')] + [(name.lower().encode(), value.encode())
+                                                        for name, value in headers.items()],
+            }
+            body_sent, finished = False, asyncio.Event()
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await finished.wait()  # the client never disconnects early
+                return {'type': 'http.disconnect'}
+
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            await application(scope, receive, send)
+            finished.set()
+            return status[0]
+
+        async def client():
+            for index in counter:
+                path, headers = requests[index % len(requests)]
+                if await request(path, headers) != 200:
+                    errors[0] += 1
+
+        async def main():
+            await asyncio.gather(*[client() for _ in range(concurrency)])
+
+        asyncio.run(main())
+        return errors[0]
+
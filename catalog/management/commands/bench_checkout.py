@@ -0,0 +1,57 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from catalog.models import Category, Product, ProductVariant, Cart, CartItem
+from catalog.orders import place_order
+from catalog.reservations import reservation_expiry
+
+class Command(BaseCommand):
+    help = ('Benchmarks checkouts per second on the configured database: places one order per prepared cart, '
+            'then replays every checkout with its idempotency key. Test data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=300, help='Checkouts to place.')
+        parser.add_argument('--lines', type=int, default=5, help='Cart lines per checkout.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            carts = self.create_data(options)
+
+            with CaptureQueriesContext(connection) as queries:
+                place_order(carts[0].user, carts[0].pk, 'bench-0')
+            started = time.perf_counter()
+            for index, cart in enumerate(carts[1:], start=1):
+                place_order(cart.user, cart.pk, f'bench-{index}')
+            placed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for index, cart in enumerate(carts):
+                place_order(cart.user, cart.pk, f'bench-{index}')
+            replayed = time.perf_counter() - started
+
+            count = len(carts) - 1
+            self.stdout.write(f'checkout ({options["lines"]} lines)  {count / placed:8.1f} orders/s  '
+                              f'{len(queries)} queries per checkout')
+            self.stdout.write(f'idempotent replay     {len(carts) / replayed:8.1f} orders/s')
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        category = Category.objects.create(name='Benchmark', slug='bench-checkout')
+        product = Product.objects.create(product_name='Bench product', slug='bench-checkout-product', category=category)
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(product=product, size=f'S{n}', color='Black', price='19.99', stock_quantity=options['orders'] + 1)
+            for n in range(options['lines'])
+        ])
+        users = User.objects.bulk_create([User(username=f'bench-checkout-{n}') for n in range(options['orders'] + 1)])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        expiry = reservation_expiry()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, variant=variant, quantity=1, reserved_quantity=1, reserved_until=expiry)
+            for cart in carts for variant in variants
+        ])
+        ProductVariant.objects.filter(product=product).update(reserved_quantity=F('stock_quantity'))
+        return list(Cart.objects.select_related('user').filter(pk__in=[cart.pk for cart in carts]).order_by('pk'))
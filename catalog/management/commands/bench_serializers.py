@@ -0,0 +1,86 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+from catalog.fastpath import FastSerializer
+from catalog.models import Category, Product, ProductImage, ProductVariant, Cart, CartItem
+from catalog.serializers import CartSerializer, ProductListSerializer, ProductSerializer
+
+class Command(BaseCommand):
+    help = ('Benchmarks DRF serializers against the fast-path serializer on large pages '
+            'and checks the rendered JSON is byte-identical. Test data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500, help='Products in the benchmarked page.')
+        parser.add_argument('--variants', type=int, default=6, help='Variants per product.')
+        parser.add_argument('--images', type=int, default=3, help='Images per product.')
+        parser.add_argument('--rounds', type=int, default=5, help='Timed rounds; the best one is reported.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            cart = self.create_data(options)
+            request = Request(APIRequestFactory().get(
+                '/api/products/', {'expand': 'description,product_images,variants'}, HTTP_HOST='localhost'
+            ))
+            products = list(
+                Product.objects.filter(slug__startswith='bench-').select_related('category').prefetch_related(
+                    Prefetch('variants', queryset=ProductVariant.objects.with_bucket_stock().order_by('price')), 'product_images'
+                )
+            )
+            cart = Cart.objects.prefetch_related('items__variant__product').select_related('user').get(pk=cart.pk)
+
+            cases = [
+                ('product list (expanded)', lambda: ProductListSerializer(products, many=True, context={'request': request})),
+                ('product detail x N', lambda: ProductSerializer(products, many=True, context={'request': request})),
+                ('cart', lambda: CartSerializer(cart, context={'request': request})),
+            ]
+            for label, build in cases:
+                self.run_case(label, build, options['rounds'])
+
+            transaction.set_rollback(True)
+
+    def create_data(self, options):
+        category = Category.objects.create(name='Benchmark', slug='bench-category')
+        user = User.objects.create_user('bench-user')
+        cart = Cart.objects.create(user=user)
+        for index in range(options['products']):
+            product = Product.objects.create(product_name=f'Bench product {index}', slug=f'bench-{index}',
+                                             description='Benchmark product ' * 10, category=category)
+            ProductVariant.objects.bulk_create([
+                ProductVariant(product=product, size=f'S{n}', color='Black', price='19.99', stock_quantity=10)
+                for n in range(options['variants'])
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image=f'products/bench-{index}-{n}.jpg') for n in range(options['images'])
+            ])
+        # one cart line per product (a large B2B cart)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, variant=product.variants.first(), quantity=2)
+            for product in Product.objects.filter(slug__startswith='bench-')
+        ])
+        return cart
+
+    def run_case(self, label, build, rounds):
+        renderer = JSONRenderer()
+        drf_json = renderer.render(build().data)
+        fast_json = renderer.render(FastSerializer(build()).data)
+        if drf_json != fast_json:
+            raise CommandError(f'{label}: fast-path output differs from the DRF serializer')
+
+        drf_time = min(self.time(lambda: build().data) for _ in range(rounds))
+        fast_time = min(self.time(lambda: FastSerializer(build()).data) for _ in range(rounds))
+        self.stdout.write(
+            f'{label:<26} {len(drf_json):>9} bytes  drf {drf_time * 1000:8.1f} ms  '
+            f'fast {fast_time * 1000:8.1f} ms  speedup x{drf_time / fast_time:.2f}'
+        )
+
+    @staticmethod
+    def time(func):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
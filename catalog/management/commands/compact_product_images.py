@@ -0,0 +1,66 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from catalog.caching import bump_catalog_version
+from catalog.images import blob_grace_seconds, derivative_paths, release_image
+from catalog.models import ProductImage
+from catalog.storage import BLOB_DIR, is_content_addressed, product_image_storage
+
+
+class Command(BaseCommand):
+    help = ('Moves product images still stored under their upload name into content-addressed files '
+            '(one per distinct content), then deletes content-addressed files and derivatives that no '
+            'row references and that are older than PRODUCT_IMAGE_BLOB_GRACE_SECONDS. Run '
+            'generate_image_derivatives afterwards for the moved images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        storage = product_image_storage()
+        images = ProductImage.objects.db_manager(router.db_for_write(ProductImage))
+
+        moved = 0
+        if not options['dry_run']:
+            legacy = images.exclude(image='').values_list('image', 'derivatives')
+            for name, derivatives in dict(legacy.iterator()).items():
+                if is_content_addressed(name):
+                    continue
+                try:
+                    with storage.open(name, 'rb') as original:
+                        stored = storage.save(name, original)
+                except OSError as exc:
+                    self.stderr.write(f'Image {name}: {exc}')
+                    continue
+                with transaction.atomic():
+                    moved += images.filter(image=name).update(image=stored, derivatives={})
+                    transaction.on_commit(bump_catalog_version)
+                release_image(name, derivatives)
+
+        referenced = set()
+        for name, derivatives in images.values_list('image', 'derivatives').iterator():
+            referenced.add(name)
+            referenced |= derivative_paths(derivatives)
+
+        deleted = 0
+        cutoff = time.time() - blob_grace_seconds()
+        root = storage.path(BLOB_DIR)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = '/'.join((BLOB_DIR, os.path.relpath(path, root).replace(os.sep, '/')))
+                if not (is_content_addressed(name) or name.endswith('.tmp')) or name in referenced:
+                    continue
+                if os.path.getmtime(path) >= cutoff:
+                    continue  # possibly an upload whose row is not committed yet
+                deleted += 1
+                if options['dry_run']:
+                    self.stdout.write(f'Would delete {name}')
+                else:
+                    storage.delete(name)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} images to content-addressed files. {verb} {deleted} unreferenced files.'))
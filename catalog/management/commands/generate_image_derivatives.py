@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from catalog.images import image_formats, image_quality, image_widths, render_derivatives, store_derivatives
+from catalog.models import ProductImage
+from catalog.storage import product_image_storage
+
+class Command(BaseCommand):
+    help = ('Generates the resized copies (PRODUCT_IMAGE_WIDTHS x PRODUCT_IMAGE_FORMATS) of product images '
+            'that lack them, e.g. after the widths changed, once per stored file. Images are decoded and encoded in parallel '
+            'worker processes; files are read and written, and rows updated, by this process.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes.')
+        parser.add_argument('--all', action='store_true', help='Regenerate images that are already up to date.')
+
+    def handle(self, *args, **options):
+        storage = product_image_storage()
+        widths, formats, quality = image_widths(), image_formats(), image_quality()
+        # rows showing the same file share its derivatives: each file is rendered once
+        todo = list(dict.fromkeys(
+            name
+            for name, derivatives in ProductImage.objects.exclude(image='').order_by('pk')
+                .values_list('image', 'derivatives').iterator()
+            if options['all'] or (derivatives or {}).get('source') != name
+        ))
+
+        done = failed = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            pending = {}
+
+            def collect(futures):
+                nonlocal done, failed
+                for future in futures:
+                    name = pending.pop(future)
+                    try:
+                        store_derivatives(name, future.result())
+                        done += 1
+                    except Exception as exc:
+                        failed += 1
+                        self.stderr.write(f'Image {name}: {exc}')
+
+            for name in todo:
+                try:
+                    with storage.open(name, 'rb') as original:
+                        data = original.read()
+                except OSError as exc:
+                    failed += 1
+                    self.stderr.write(f'Image {name}: {exc}')
+                    continue
+                pending[pool.submit(render_derivatives, data, widths, formats, quality)] = name
+                # keep only a few originals in memory at a time
+                if len(pending) >= options['workers'] * 2:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            collect(list(pending))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {done} images in {elapsed:.1f}s ({failed} failed, '
+            f'{options["workers"]} workers).'))
@@ -0,0 +1,105 @@
+import re
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from rest_framework.exceptions import ValidationError
+from catalog.models import Category, Product, ProductVariant, Cart
+from catalog.serializers import AddCartItemSerializer
+from catalog.stock import designate_hot_variant
+
+class Command(BaseCommand):
+    help = ('Load-tests concurrent add-to-cart on a single variant, first as a regular variant and then '
+            'as a hot variant with bucketed stock. Test data is deleted afterwards. Reports throughput and '
+            'the writes that landed on the hottest row (the variant, or the busiest bucket): every one of '
+            'them queues behind the previous one on Postgres/MySQL. SQLite serializes all writers anyway, '
+            'so there only the hot-row writes show the effect of the buckets.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent shoppers.')
+        parser.add_argument('--adds', type=int, default=25, help='Add-to-cart calls per shopper.')
+        parser.add_argument('--shards', type=int, default=8, help='Stock buckets for the hot run.')
+
+    def handle(self, *args, **options):
+        for label, shards in (('regular variant', 0), (f'hot variant ({options["shards"]} buckets)', options['shards'])):
+            variant, carts = self.create_data(options)
+            try:
+                if shards:
+                    designate_hot_variant(variant.pk, shards)
+                self.run(label, variant, carts, options['adds'])
+            finally:
+                self.delete_data(variant, carts)
+
+    def create_data(self, options):
+        category = Category.objects.create(name='Load test', slug='loadtest-category')
+        product = Product.objects.create(product_name='Load test product', slug='loadtest-product', category=category)
+        variant = ProductVariant.objects.create(product=product, size='M', color='Black', price='9.99',
+                                                stock_quantity=options['threads'] * options['adds'])
+        carts = [Cart.objects.create(user=User.objects.create_user(f'loadtest-{n}')) for n in range(options['threads'])]
+        return variant, carts
+
+    def delete_data(self, variant, carts):
+        product = variant.product
+        User.objects.filter(pk__in=[cart.user_id for cart in carts]).delete()  # cascades to carts and lines
+        product.delete()  # cascades to the variant and its buckets
+        product.category.delete()
+
+    def run(self, label, variant, carts, adds):
+        added, errors = [0], []
+        row_writes = Counter()  # successful UPDATEs per contended row
+        lock = threading.Lock()
+
+        def count_row_writes(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if sql.startswith('UPDATE') and context['cursor'].rowcount > 0:
+                if sql.startswith('UPDATE "catalog_productvariant"'):
+                    row = 'variant'
+                elif sql.startswith('UPDATE "catalog_product"'):
+                    row = 'product'
+                elif sql.startswith('UPDATE "catalog_stockbucket"') and (match := re.search(r'"index" = %s', sql)):
+                    row = f'bucket {params[sql[:match.start()].count("%s")]}'
+                else:
+                    return result
+                with lock:
+                    row_writes[row] += context['cursor'].rowcount
+            return result
+
+        def shopper(cart):
+            try:
+                with connection.execute_wrapper(count_row_writes):
+                    self.add_to_cart(cart, variant, adds, added, errors, lock)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shopper, args=(cart,)) for cart in carts]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        hottest, hottest_writes = max(row_writes.items(), key=lambda item: item[1], default=('-', 0))
+        self.stdout.write(f'{label:<28} {added[0]:>6} adds in {elapsed:6.2f}s '
+                          f'({added[0] / elapsed:8.1f} adds/s), {len(errors)} errors, '
+                          f'hottest row: {hottest} ({hottest_writes} writes)')
+        if errors:
+            self.stdout.write(f'{"":<28} first error: {errors[0]}')
+
+    @staticmethod
+    def add_to_cart(cart, variant, adds, added, errors, lock):
+        for _ in range(adds):
+            serializer = AddCartItemSerializer(data={'variant_id': variant.pk, 'quantity': 1},
+                                               context={'cart_id': cart.pk})
+            try:
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            except (ValidationError, DatabaseError) as exc:
+                with lock:
+                    errors.append(exc)
+            else:
+                with lock:
+                    added[0] += 1
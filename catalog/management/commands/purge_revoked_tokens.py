@@ -0,0 +1,8 @@
+from django.core.management.base import BaseCommand
+from catalog.authentication import purge_revoked_tokens
+
+class Command(BaseCommand):
+    help = 'Deletes JWT denylist entries whose tokens have expired anyway. Run it from cron daily.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f'Deleted {purge_revoked_tokens()} expired revocations.'))
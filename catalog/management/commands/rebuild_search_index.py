@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from catalog.search import search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the Product table.'
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            search_backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt ({search_backend.__class__.__name__}).'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from catalog.models import ProductVariant
+from catalog.stock import reconcile_hot_variant
+
+class Command(BaseCommand):
+    help = 'Recomputes reserved stock of hot variants and rebalances their stock buckets. Run it from cron every minute or so.'
+
+    def handle(self, *args, **options):
+        variant_ids = list(ProductVariant.objects.filter(stock_shards__gt=0).values_list('pk', flat=True))
+        for variant_id in variant_ids:
+            reconcile_hot_variant(variant_id)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {len(variant_ids)} hot variants.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from catalog.models import Cart
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized item_count and subtotal columns on Cart from its lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report carts whose stored totals drifted.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            drifted = Cart.objects.with_live_totals().exclude(
+                Q(item_count=F('live_item_count')) & Q(subtotal=F('live_subtotal'))
+            ).count()
+            self.stdout.write(f'{drifted} carts have drifted totals.')
+            return
+        with transaction.atomic():
+            updated = Cart.objects.all().refresh_totals()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed totals for {updated} carts.'))
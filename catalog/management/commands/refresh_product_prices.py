@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from catalog.models import Product
+
+class Command(BaseCommand):
+    help = 'Backfills the denormalized min_price, max_price and in_stock columns on Product from its variants.'
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            updated = Product.objects.all().refresh_variant_summary()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed price summary; {updated} products changed.'))
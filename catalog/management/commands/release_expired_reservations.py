@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from catalog.reservations import release_expired_holds
+
+class Command(BaseCommand):
+    help = 'Releases expired cart stock reservations in bulk. Run it from cron every minute or so.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Cart lines released per transaction.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = release_expired_holds(limit=options['batch_size'])
+            total += released
+            if released < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Released {total} expired reservations.'))
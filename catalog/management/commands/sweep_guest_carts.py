@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from catalog.carts import sweep_guest_carts
+
+class Command(BaseCommand):
+    help = 'Deletes abandoned guest carts (untouched for CART_GUEST_DAYS) and releases their stock. Run it from cron daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Carts deleted per transaction.')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            deleted = sweep_guest_carts(limit=options['batch_size'])
+            total += deleted
+            if deleted < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Deleted {total} abandoned guest carts.'))
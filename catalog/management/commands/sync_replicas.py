@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+class Command(BaseCommand):
+    help = ('Copies the primary SQLite database into every SQLite alias in DATABASE_REPLICAS with the online '
+            'backup API, for trying out replica routing locally. Run it periodically to simulate replication lag.')
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured; set CATALOG_REPLICA_DBS.')
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections[alias]
+            if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+                raise CommandError(f'{alias}: only SQLite databases can be synced this way.')
+            primary.ensure_connection()
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            self.stdout.write(self.style.SUCCESS(f'Synced {alias} ({replica.settings_dict["NAME"]}).'))
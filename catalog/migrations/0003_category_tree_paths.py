@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    # Historical models have no custom save(), so walk the tree top-down here.
+    Category = apps.get_model('catalog', 'Category')
+    level = list(Category.objects.filter(parent_category=None))
+    parents = {}
+    while level:
+        for category in level:
+            parent = parents.get(category.parent_category_id)
+            segment = f'{category.pk:08d}/'
+            if parent is None:
+                category.path, category.depth, category.full_name = segment, 0, category.name
+            else:
+                category.path = parent.path + segment
+                category.depth = parent.depth + 1
+                category.full_name = f'{parent.full_name} -> {category.name}'
+            parents[category.pk] = category
+        Category.objects.bulk_update(level, ['path', 'depth', 'full_name'])
+        level = list(Category.objects.filter(parent_category__in=[c.pk for c in level]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_alter_category_name_alter_category_unique_together'),
+    ]
+
+    operations = [
+        # Not part of the tree columns: the models already declare these as UniqueConstraints, while
+        # 0001/0002 still had unique_together, so makemigrations picked the conversion up here.
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productvariant',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='full_name',
+            field=models.CharField(default='', editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('name', 'parent_category'), name='unique_category_per_parent'),
+        ),
+        migrations.AddConstraint(
+            model_name='productvariant',
+            constraint=models.UniqueConstraint(fields=('product', 'size', 'color'), name='unique_category_per_variant'),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:16
+
+from django.db import migrations, models
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+
+
+def backfill_price_summary(apps, schema_editor):
+    # Same statement as ProductQuerySet.refresh_variant_summary (historical models lack custom querysets).
+    Product = apps.get_model('catalog', 'Product')
+    ProductVariant = apps.get_model('catalog', 'ProductVariant')
+    variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    Product.objects.update(
+        min_price=Subquery(variants.annotate(value=Min('price')).values('value')),
+        max_price=Subquery(variants.annotate(value=Max('price')).values('value')),
+        in_stock=Exists(ProductVariant.objects.filter(product=OuterRef('pk'), stock_quantity__gt=0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_category_tree_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='in_stock',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(backfill_price_summary, migrations.RunPython.noop),
+    ]
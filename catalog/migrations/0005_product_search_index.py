@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:02
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # Inverted index for product search; which one depends on the database (see catalog/search.py).
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE catalog_product_fts USING fts5("
+            "product_name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO catalog_product_fts (rowid, product_name, description) '
+            'SELECT id, product_name, description FROM catalog_product'
+        )
+    elif connection.vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from catalog.search import search_document
+
+        Product = apps.get_model('catalog', 'Product')
+        schema_editor.add_index(Product, GinIndex(search_document(), name='catalog_product_search_idx'))
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_product_fts')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS catalog_product_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_product_price_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
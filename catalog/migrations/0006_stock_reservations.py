@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:25
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.utils import timezone
+
+
+def convert_cart_decrements_to_holds(apps, schema_editor):
+    # Lines already in carts took their units out of stock_quantity. Put them back on hand
+    # and turn them into fresh holds instead, so available stock is unchanged.
+    CartItem = apps.get_model('catalog', 'CartItem')
+    ProductVariant = apps.get_model('catalog', 'ProductVariant')
+    totals = CartItem.objects.values('variant_id').annotate(total=Sum('quantity'))
+    for row in totals:
+        ProductVariant.objects.filter(pk=row['variant_id']).update(
+            stock_quantity=F('stock_quantity') + row['total'],
+            reserved_quantity=row['total'],
+        )
+    CartItem.objects.update(reserved_quantity=F('quantity'), reserved_until=timezone.now() + timedelta(minutes=15))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(convert_cart_decrements_to_holds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:34
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    # Same statement as CartQuerySet.refresh_totals (historical models lack custom querysets).
+    Cart = apps.get_model('catalog', 'Cart')
+    CartItem = apps.get_model('catalog', 'CartItem')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    line_total = ExpressionWrapper(F('quantity') * F('variant__price'), output_field=money)
+    Cart.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(value=Sum('quantity')).values('value')), 0),
+        subtotal=Coalesce(Subquery(lines.annotate(value=Sum(line_total)).values('value')), Value(Decimal('0.00')),
+                          output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_hot_variant_stock_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
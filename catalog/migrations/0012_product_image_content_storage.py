@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:04
+
+import catalog.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_product_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(help_text='Image for the product.', storage=catalog.storage.product_image_storage, upload_to='products/'),
+        ),
+    ]
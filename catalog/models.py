@@ -1,13 +1,53 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Exists, ExpressionWrapper, F, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Now, Substr
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 
+from .caching import bump_catalog_version
+from .storage import product_image_storage
+
+# Materialized path settings: every category stores the zero-padded ids of its
+# ancestors (and itself), e.g. "00000001/00000004/", so subtree lookups become a
+# single indexed range scan instead of a recursive walk.
+PATH_STEP = 8
+PATH_SEPARATOR = '/'
+DISPLAY_SEPARATOR = ' -> '
+
+
+class CategoryQuerySet(models.QuerySet):
+
+    def descendants_of(self, category, include_self=True):
+        # Every descendant path starts with the parent's path, and ':' sorts after
+        # both digits and the separator, so this is a closed index range.
+        queryset = self.filter(path__gte=category.path, path__lt=category.path + ':')
+        if not include_self:
+            queryset = queryset.exclude(pk=category.pk)
+        return queryset
+
+    def descendants_of_slug(self, slug):
+        # Same range with the root's path as a subquery: building it runs no query, and an
+        # unknown slug matches nothing.
+        root_path = Subquery(Category.objects.filter(slug=slug).values('path')[:1])
+        return self.filter(path__gte=root_path, path__lt=Concat(root_path, Value(':')))
+
+
 class Category(models.Model):
 
     name = models.CharField(max_length=100)
     slug = models.SlugField(max_length=120, unique=True)
     parent_category = models.ForeignKey('self', on_delete=models.CASCADE, blank=True , null=True , related_name='subcategories')
 
+    # Denormalized tree columns, maintained in save(). Never edit by hand.
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    full_name = models.CharField(max_length=500, editable=False, default='')
+
+    objects = CategoryQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Categories" 
         constraints = [
@@ -15,13 +55,92 @@ class Category(models.Model):
     ]
 
     def __str__(self):
-        # Shows the hierarchy in the admin panel for clarity.
-        full_path = [self.name]
-        k = self.parent_category
-        while k is not None:
-            full_path.append(k.name)
-            k = k.parent_category
-        return ' -> '.join(full_path[::-1])
+        # Shows the hierarchy in the admin panel for clarity, read from the stored column.
+        return self.full_name or self.name
+
+    def clean(self):
+        parent = self.parent_category
+        if parent is not None and self.pk and parent.path.startswith(self.path):
+            raise ValidationError({'parent_category': "A category cannot be moved under itself or one of its descendants."})
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._update_tree_fields()
+
+    def _update_tree_fields(self):
+        """
+        Recompute path/depth/full_name from the parent and, on a move or rename,
+        rewrite the whole subtree with one UPDATE.
+        """
+        parent = self.parent_category
+        old_path, old_depth, old_full_name = self.path, self.depth, self.full_name
+
+        segment = f'{self.pk:0{PATH_STEP}d}{PATH_SEPARATOR}'
+        if parent is None:
+            self.path, self.depth, self.full_name = segment, 0, self.name
+        else:
+            self.path = parent.path + segment
+            self.depth = parent.depth + 1
+            self.full_name = f'{parent.full_name}{DISPLAY_SEPARATOR}{self.name}'
+
+        if (old_path, old_depth, old_full_name) == (self.path, self.depth, self.full_name):
+            return
+
+        Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth, full_name=self.full_name)
+
+        if old_path:
+            # existing node was moved or renamed -> shift every descendant in one statement
+            Category.objects.filter(path__gt=old_path, path__lt=old_path + ':').update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (self.depth - old_depth),
+                full_name=Concat(Value(self.full_name), Substr('full_name', len(old_full_name) + 1)),
+            )
+
+    def get_ancestor_ids(self):
+        return [int(part) for part in self.path.split(PATH_SEPARATOR)[:-2]]
+
+    def get_ancestors(self):
+        return Category.objects.filter(pk__in=self.get_ancestor_ids()).order_by('depth')
+
+    def get_descendants(self, include_self=False):
+        return Category.objects.descendants_of(self, include_self=include_self)
+
+    def get_breadcrumbs(self):
+        # Names straight from the stored display path, no queries.
+        return self.full_name.split(DISPLAY_SEPARATOR)
+
+class ProductQuerySet(models.QuerySet):
+
+    def refresh_variant_summary(self):
+        """
+        Recompute min_price/max_price/in_stock from the variants in a single UPDATE.
+        Call this (inside the same transaction) wherever variant prices or stock change.
+        Only rows whose summary actually moves are written; returns how many.
+        """
+        variants = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        summary = {
+            'min_price': Subquery(variants.annotate(value=Min('price')).values('value')),
+            'max_price': Subquery(variants.annotate(value=Max('price')).values('value')),
+            # a hot variant's available units are in its buckets, not in reserved_quantity (see catalog/stock.py)
+            'in_stock': ExpressionWrapper(
+                Q(Exists(ProductVariant.objects.filter(product=OuterRef('pk'), stock_shards=0, stock_quantity__gt=F('reserved_quantity'))))
+                | Q(Exists(StockBucket.objects.filter(variant__product=OuterRef('pk'), variant__stock_shards__gt=0, quantity__gt=0))),
+                output_field=models.BooleanField(),
+            ),
+        }
+        no_price = Value(Decimal('-1'))  # NULL-safe comparison of the prices
+        updated = self.alias(
+            old_min=Coalesce('min_price', no_price), new_min=Coalesce(summary['min_price'], no_price),
+            old_max=Coalesce('max_price', no_price), new_max=Coalesce(summary['max_price'], no_price),
+            new_in_stock=summary['in_stock'],
+        ).exclude(old_min=F('new_min'), old_max=F('new_max'), in_stock=F('new_in_stock')).update(**summary)
+        if updated:
+            # a listed price or stock flag changed through update() (cart paths), which sends no signals:
+            # invalidate cached catalogue responses. Holds that leave every summary as it was don't.
+            transaction.on_commit(bump_catalog_version)
+        return updated
+
 
 class Product(models.Model):
     product_name = models.CharField(max_length=200)
@@ -32,15 +151,36 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at =  models.DateTimeField(auto_now=True)
 
+    # Denormalized from variants so listing filters/ordering never join ProductVariant.
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, db_index=True, editable=False)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, db_index=True, editable=False)
+    in_stock = models.BooleanField(default=False, db_index=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.product_name
-    
+
+class ProductVariantQuerySet(models.QuerySet):
+
+    def with_bucket_stock(self):
+        # Hot variants' available units summed from their buckets in the same query, so
+        # available_quantity needs no query per variant when rendering a listing.
+        buckets = StockBucket.objects.filter(variant=OuterRef('pk')).order_by().values('variant')
+        return self.annotate(bucket_quantity=Subquery(buckets.annotate(total=Sum('quantity')).values('total')))
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(Product , on_delete=models.CASCADE ,related_name='variants')
     size = models.CharField(max_length=50)
     color = models.CharField(max_length=50)
     price = models.DecimalField(max_digits=10 , decimal_places=2 , validators=[MinValueValidator(0.01)])
-    stock_quantity = models.PositiveIntegerField(default=0)
+    stock_quantity = models.PositiveIntegerField(default=0) # units on hand
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False) # units held by active cart reservations
+    # >0 marks a flash-sale "hot" variant whose available stock is split across this many
+    # StockBucket rows, so concurrent adds don't queue on this row (see catalog/stock.py)
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = ProductVariantQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -50,17 +190,110 @@ class ProductVariant(models.Model):
     def __str__(self):
         return f"{self.product.product_name} ({self.size}, {self.color})"
 
+    @property
+    def available_quantity(self):
+        # what can still be put in a cart; for a hot variant, whatever is left in its buckets
+        # (reserved_quantity only catches up with their claims when reconciled)
+        if self.stock_shards:
+            if not hasattr(self, 'bucket_quantity'):
+                self.bucket_quantity = self.stock_buckets.aggregate(total=Sum('quantity'))['total']
+            return self.bucket_quantity or 0
+        return max(self.stock_quantity - self.reserved_quantity, 0)
+
+    # Maintained only by conditional UPDATEs (catalog.reservations, catalog.stock): the copy loaded
+    # with an instance may be stale by the time it is saved, e.g. an admin restock while carts hold units.
+    COUNTER_FIELDS = ('reserved_quantity', 'stock_shards')
+
+    def save(self, *args, **kwargs):
+        updating = not self._state.adding and not kwargs.get('force_insert')
+        if updating and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if updating:
+                self.refresh_from_db(fields=self.COUNTER_FIELDS)  # current values for the post_save receivers
+            Product.objects.filter(pk=self.product_id).refresh_variant_summary()
+            # the price may have changed under carts holding this variant
+            Cart.objects.filter(items__variant=self).refresh_totals()
+
+class StockBucket(models.Model):
+    # One shard of a hot variant's available units. Claimed with a conditional UPDATE,
+    # periodically rebalanced against on-hand stock and cart holds.
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='stock_buckets')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+        models.UniqueConstraint(fields=['variant', 'index'], name='unique_bucket_per_variant'),
+    ]
+
+    def __str__(self):
+        return f"Bucket {self.index} of {self.variant}: {self.quantity}"
+
+def cart_totals():
+    """
+    (item_count, subtotal) of the cart at OuterRef('pk'), aggregated from its lines
+    in the database; shared by refresh_totals() and the with_live_totals() fallback.
+    """
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    line_total = ExpressionWrapper(F('quantity') * F('variant__price'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+    return (
+        Coalesce(Subquery(lines.annotate(value=Sum('quantity')).values('value')), 0),
+        Coalesce(Subquery(lines.annotate(value=Sum(line_total)).values('value')), Value(Decimal('0.00')),
+                 output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+    )
+
+class CartQuerySet(models.QuerySet):
+
+    def refresh_totals(self):
+        """
+        Recompute item_count/subtotal from the lines in a single UPDATE.
+        Call this (inside the same transaction) wherever cart lines or their prices change.
+        """
+        item_count, subtotal = cart_totals()
+        return self.update(item_count=item_count, subtotal=subtotal, updated_at=Now())
+
+    def with_live_totals(self):
+        # Fallback that ignores the stored columns: live_item_count/live_subtotal straight from the lines.
+        item_count, subtotal = cart_totals()
+        return self.annotate(live_item_count=item_count, live_subtotal=subtotal)
+
 class Cart(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    # A cart belongs either to a user or to a guest, who names it by guest_token (X-Cart-Token header).
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart', null=True, blank=True)
+    guest_token = models.CharField(max_length=32, unique=True, null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every cart change (refresh_totals); abandoned guest carts are swept by it.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Denormalized from the lines so mini-cart badges and headers are one row read.
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+        models.CheckConstraint(
+            condition=models.Q(user__isnull=False, guest_token__isnull=True) | models.Q(user__isnull=True, guest_token__isnull=False),
+            name='cart_has_one_owner',
+        ),
+    ]
 
     def __str__(self):
+        if self.user_id is None:
+            return f"Guest cart {self.guest_token[:6]}"
         return f"Cart for {self.user.username}"
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart , on_delete=models.CASCADE, related_name='items')
     variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.PositiveIntegerField(default=1)
+    # Stock hold for this line: units counted in variant.reserved_quantity until reserved_until.
+    # An expired hold is released by the sweeper (reserved_quantity -> 0); the line stays in the cart.
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
+    reserved_until = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
 
     class Meta:
         unique_together = ('cart', 'variant')
@@ -68,9 +301,53 @@ class CartItem(models.Model):
     def __str__(self):
         return f"{self.quantity} of {self.variant}" 
     
+class Order(models.Model):
+    # Placed from a cart by catalog.orders.place_order(); (user, idempotency_key) makes retries safe.
+    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='orders')
+    idempotency_key = models.CharField(max_length=64)
+    item_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+        models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_order_per_idempotency_key'),
+    ]
+
+    def __str__(self):
+        return f"Order #{self.pk} by {self.user.username}"
+
+class OrderLine(models.Model):
+    # Name and price are snapshots taken at checkout; later catalogue edits don't rewrite orders.
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.SET_NULL, null=True, related_name='order_lines')
+    product_name = models.CharField(max_length=200)
+    size = models.CharField(max_length=50)
+    color = models.CharField(max_length=50)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} of {self.product_name} ({self.size}, {self.color})"
+
+class RevokedToken(models.Model):
+    # JWT denylist (catalog.authentication), shared by every worker and never evicted: one access
+    # token by its jti, or "user:<id>" for every token that user got until revoked_at. A row is
+    # useless once expires_at (the token's exp) has passed; purge_revoked_tokens deletes those.
+    key = models.CharField(max_length=255, primary_key=True)
+    revoked_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Revoked {self.key} until {self.expires_at:%Y-%m-%d %H:%M}"
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_images')
-    image = models.ImageField(upload_to='products/', help_text="Image for the product.")
+    # stored once per distinct content, under its SHA-256 (catalog.storage); the file goes when
+    # the last row naming it does (catalog.images.release_image)
+    image = models.ImageField(upload_to='products/', storage=product_image_storage, help_text="Image for the product.")
+    # resized copies written by catalog.images: {"source": image name, "sizes": {format: {width: path}}}
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.product.product_name}"
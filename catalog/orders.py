@@ -0,0 +1,89 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from .db import retry_on_busy
+from .models import Cart, CartItem, Order, OrderLine, Product, ProductVariant
+from .reservations import hold_cart_lines
+from .stock import commit_stock
+
+
+class CheckoutError(Exception):
+    def __init__(self, message, failures=None):
+        super().__init__(message)
+        self.failures = failures or {}
+
+
+@retry_on_busy
+def place_order(user, cart_id, idempotency_key):
+    """
+    Turn the cart into an Order in one short transaction: prices and names are snapshotted
+    from the variants, the cart's holds become committed stock (one UPDATE), and the cart
+    is emptied. The same (user, idempotency_key) always yields the same order, so client
+    retries never place or decrement twice.
+
+    Returns (order, created). Raises CheckoutError for an empty cart or missing stock.
+    """
+    order = Order.objects.filter(user_id=user.pk, idempotency_key=idempotency_key).first()
+    if order is not None:
+        return order, False
+    try:
+        with transaction.atomic():
+            return _place_order(user, cart_id, idempotency_key)
+    except IntegrityError:
+        # a concurrent retry with the same key got there first, or stock was cut below what the cart holds
+        order = Order.objects.filter(user_id=user.pk, idempotency_key=idempotency_key).first()
+        if order is None:
+            raise CheckoutError("Some items are no longer available.")
+        return order, False
+
+
+def _place_order(user, cart_id, idempotency_key):
+    lines = CartItem.objects.filter(cart_id=cart_id)
+    # lock the counters in a fixed order (same order as the cart paths) before reading the lines
+    variants = {
+        variant.pk: variant
+        for variant in ProductVariant.objects.select_for_update().select_related('product')
+        .filter(pk__in=lines.values('variant_id')).order_by('pk')
+    }
+    # a retry that waited on those locks sees the order its twin just committed
+    order = Order.objects.filter(user_id=user.pk, idempotency_key=idempotency_key).first()
+    if order is not None:
+        return order, False
+
+    items = list(lines.select_for_update().order_by('pk'))
+    if not items:
+        raise CheckoutError("The cart is empty.")
+
+    expired = {item.variant_id: item.quantity for item in items if item.reserved_quantity < item.quantity}
+    if expired:
+        # holds that lapsed must be taken again before the units can be sold
+        failures = hold_cart_lines(cart_id, expired, add=False)
+        if failures:
+            raise CheckoutError("Some items are no longer available.", failures)
+
+    totals = defaultdict(int)
+    order_lines = []
+    for item in items:
+        variant = variants[item.variant_id]
+        totals[variant.pk] += item.quantity
+        order_lines.append(OrderLine(
+            variant=variant, product_name=variant.product.product_name, size=variant.size, color=variant.color,
+            unit_price=variant.price, quantity=item.quantity,
+        ))
+
+    order = Order.objects.create(
+        user_id=user.pk, idempotency_key=idempotency_key,
+        item_count=sum(line.quantity for line in order_lines),
+        total=sum((line.unit_price * line.quantity for line in order_lines), Decimal('0.00')),
+    )
+    for line in order_lines:
+        line.order = order
+    OrderLine.objects.bulk_create(order_lines)
+
+    commit_stock(totals, hot={variant_id for variant_id, variant in variants.items() if variant.stock_shards})
+    CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+    Cart.objects.filter(pk=cart_id).refresh_totals()
+    Product.objects.filter(variants__in=list(totals)).refresh_variant_summary()
+    return order, True
@@ -0,0 +1,171 @@
+import base64
+import datetime
+import decimal
+import json
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .caching import query_cache_key
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset ("seek") pagination for infinite scroll.
+
+    The cursor stores the sort key of the last row served, and the next page is
+    fetched with `WHERE (sort key) > (cursor)` instead of OFFSET, so every page
+    costs the same and rows inserted meanwhile never shift or duplicate results.
+    The active ordering comes from the queryset (i.e. OrderingFilter), with `id`
+    appended as a unique tie-breaker. No COUNT(*) is issued unless `?count=true`
+    is passed, and even then the value is cached for a short while per filter set.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size = api_settings.PAGE_SIZE
+    default_ordering = ('-created_at',)
+    count_cache_timeout = 60
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.prepare(queryset, request)
+        self.count = self.get_count(queryset, request) if self.count_requested(request) else None
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # same page, fetched with the async ORM (catalog.async_views)
+        queryset = self.prepare(queryset, request)
+        self.count = await self.aget_count(queryset, request) if self.count_requested(request) else None
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def prepare(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        return queryset.order_by(*[self.order_expression(field) for field in self.ordering])
+
+    def page_queryset(self, queryset, request):
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after_position(position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        content = OrderedDict([('next', self.get_next_link())])
+        if self.count is not None:
+            content['count'] = self.count
+        content['results'] = data
+        return Response(content)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(values))
+
+    def get_ordering(self, queryset):
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)]
+        if not ordering:
+            ordering = list(self.default_ordering)
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            # unique tie-breaker so equal sort values never straddle a page boundary ambiguously
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def order_expression(self, field):
+        name = field.lstrip('-')
+        # NULLs (e.g. products without variants) always sort last so the seek condition stays simple
+        return F(name).desc(nulls_last=True) if field.startswith('-') else F(name).asc(nulls_last=True)
+
+    def after_position(self, position):
+        """
+        Lexicographic "row comes after position" for the current ordering:
+        (a > x) OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+        """
+        condition = Q(pk__in=[])
+        prefix = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            if value is None:
+                # nulls sort last, so nothing is strictly after a null; only ties remain
+                after, equal = Q(pk__in=[]), Q(**{f'{name}__isnull': True})
+            else:
+                lookup = 'lt' if field.startswith('-') else 'gt'
+                after = Q(**{f'{name}__{lookup}': value}) | Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            condition |= prefix & after
+            prefix &= equal
+        return condition
+
+    def encode_cursor(self, values):
+        payload = json.dumps({'o': self.ordering, 'v': values}, default=self.encode_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def encode_value(value):
+        # full precision: DjangoJSONEncoder would cut datetimes to milliseconds and break the seek
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, decimal.Decimal):
+            return str(value)
+        raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if payload['o'] != self.ordering or len(payload['v']) != len(self.ordering):
+                raise ValueError
+            return [self.decode_value(field.lstrip('-'), value) for field, value in zip(self.ordering, payload['v'])]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def decode_value(self, name, value):
+        if value is None:
+            return None
+        try:
+            return self.model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            # annotations such as search_rank are stored as plain JSON numbers
+            if not isinstance(value, (int, float)):
+                raise ValueError(name)
+            return value
+
+    def count_requested(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def count_cache_key(self, request):
+        # Cached per normalized filter set; cursors and the count flag itself don't change the total.
+        return query_cache_key('catalog:keyset-count', request, ignore=(self.cursor_query_param, self.count_query_param))
+
+    def get_count(self, queryset, request):
+        key = self.count_cache_key(request)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.order_by().count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count
+
+    async def aget_count(self, queryset, request):
+        key = self.count_cache_key(request)
+        count = await cache.aget(key)
+        if count is None:
+            count = await queryset.order_by().acount()
+            await cache.aset(key, count, self.count_cache_timeout)
+        return count
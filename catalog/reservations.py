@@ -0,0 +1,242 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .db import retry_on_busy
+from .models import Cart, CartItem, Product, ProductVariant
+from .stock import (adjust_reserved, claim_hot_stock, claim_stock, hot_available, reconcile_hot_variant,
+                    release_hot_stock, release_stock)
+
+# Minutes a cart line keeps its units out of available stock after it was last added/updated.
+DEFAULT_RESERVATION_MINUTES = 15
+
+# hold_cart_line() starts over when another request changed the same line in between.
+MAX_HOLD_ATTEMPTS = 3
+
+
+class LineChanged(Exception):
+    pass
+
+
+class StockShort(Exception):
+    pass
+
+
+class LinesRejected(Exception):
+    def __init__(self, failures):
+        super().__init__(failures)
+        self.failures = failures
+
+
+def reservation_expiry(now=None):
+    minutes = getattr(settings, 'CART_RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES)
+    return (now or timezone.now()) + timedelta(minutes=minutes)
+
+
+@retry_on_busy
+def release_cart_lines(items, delete=False):
+    """
+    Give the stock held by a CartItem queryset back in one go, whatever the number of
+    lines: the variants are locked in pk order, the lines read once, and the holds go
+    back through release_stock() (one grouped UPDATE). With `delete` the lines are
+    removed too, otherwise they stay in their carts without a hold.
+    Returns the number of lines.
+    """
+    with transaction.atomic():
+        # lock the counters in a fixed order (same order as the cart paths) before reading the holds
+        list(ProductVariant.objects.select_for_update().filter(pk__in=items.values('variant_id')).order_by('pk').values_list('pk', flat=True))
+        rows = list(items.select_for_update().values_list('pk', 'cart_id', 'variant_id', 'reserved_quantity'))
+        if not rows:
+            return 0
+
+        totals = defaultdict(int)
+        for _, _, variant_id, quantity in rows:
+            totals[variant_id] += quantity
+        release_stock(totals)
+        lines = CartItem.objects.filter(pk__in=[row[0] for row in rows])
+        if delete:
+            lines.delete()
+            Cart.objects.filter(pk__in={row[1] for row in rows}).refresh_totals()
+        else:
+            lines.update(reserved_quantity=0, reserved_until=None)
+        Product.objects.filter(variants__in=list(totals)).refresh_variant_summary()
+    return len(rows)
+
+
+@retry_on_busy
+def release_expired_holds(variant_ids=None, now=None, limit=500):
+    """
+    Give the units of expired holds back to available stock, in bulk (see
+    release_cart_lines()), at most `limit` lines per call.
+    Returns the number of lines released. The lines themselves stay in their carts.
+    """
+    now = now or timezone.now()
+    expired = CartItem.objects.filter(reserved_quantity__gt=0, reserved_until__lte=now)
+    if variant_ids is not None:
+        expired = expired.filter(variant_id__in=variant_ids)
+
+    with transaction.atomic():
+        candidates = list(expired.order_by('pk').values_list('pk', flat=True)[:limit])
+        if not candidates:
+            return 0
+        # re-checked under the locks: a line renewed meanwhile is left alone
+        return release_cart_lines(expired.filter(pk__in=candidates))
+
+@retry_on_busy
+def hold_cart_line(cart_id, variant_id, quantity, add=True):
+    """
+    Set (or with `add`, increase) a cart line's quantity and hold the units it doesn't
+    hold yet, without SELECT ... FOR UPDATE: the line is read plainly, the stock is
+    claimed with one conditional UPDATE and the line is written only if it still holds
+    what was read (otherwise the whole attempt starts over).
+
+    Returns (cart_item, None) on success or (None, available) when stock is short.
+    Raises ProductVariant.DoesNotExist for an unknown variant.
+    """
+    released = False
+    for _ in range(MAX_HOLD_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                item = CartItem.objects.filter(cart_id=cart_id, variant_id=variant_id).first()
+                new_qty = (item.quantity if item and add else 0) + quantity
+                # units to newly hold (a line whose hold expired re-reserves all of it); negative releases
+                need = new_qty - (item.reserved_quantity if item else 0)
+                hot = False
+
+                if need > 0 and not claim_stock(variant_id, need):
+                    variant = ProductVariant.objects.get(pk=variant_id)
+                    hot = bool(variant.stock_shards)
+                    if hot:
+                        if not claim_hot_stock(variant_id, variant.stock_shards, need):
+                            available = reconcile_hot_variant(variant_id, claim=need)
+                            if available < need:
+                                return None, available
+                        elif not hot_available(variant_id):
+                            # that took the last units: flip the listing's in_stock now, not at the next reconcile
+                            Product.objects.filter(variants=variant_id).refresh_variant_summary()
+                    elif released:
+                        return None, variant.available_quantity
+                    else:
+                        raise StockShort
+                elif need < 0:
+                    release_stock({variant_id: -need})
+
+                expiry = reservation_expiry()
+                if item:
+                    written = CartItem.objects.filter(
+                        pk=item.pk, quantity=item.quantity, reserved_quantity=item.reserved_quantity
+                    ).update(quantity=new_qty, reserved_quantity=new_qty, reserved_until=expiry)
+                    if not written:
+                        raise LineChanged
+                    item.quantity = item.reserved_quantity = new_qty
+                    item.reserved_until = expiry
+                else:
+                    item = CartItem.objects.create(
+                        cart_id=cart_id, variant_id=variant_id,
+                        quantity=new_qty, reserved_quantity=new_qty, reserved_until=expiry,
+                    )
+                if need and not hot:
+                    # keep the listing's in_stock flag in step (hot claims refresh it above when they empty the buckets)
+                    Product.objects.filter(variants=variant_id).refresh_variant_summary()
+                Cart.objects.filter(pk=cart_id).refresh_totals()
+                return item, None
+        except StockShort:
+            # abandoned carts may still be sitting on this variant: hand their expired holds back once
+            released = True
+            release_expired_holds(variant_ids=[variant_id])
+        except IntegrityError:
+            # a line for an unknown variant (nothing was claimed to notice it), or a concurrent
+            # request created the same line first: only the latter is worth re-reading
+            if not ProductVariant.objects.filter(pk=variant_id).exists():
+                raise ProductVariant.DoesNotExist(f'No variant {variant_id}.')
+        except LineChanged:
+            # a concurrent request wrote the same line first; re-read it
+            pass
+    raise LineChanged('The cart line kept changing; try again.')
+
+
+@retry_on_busy
+def hold_cart_lines(cart_id, quantities, add=True, partial=False):
+    """
+    hold_cart_line() for many lines at once, {variant_id: quantity}, in one transaction.
+    The variants are locked in pk order (the order every other path locks them in), then
+    their lines; stock moves in one grouped UPDATE and the lines in bulk. With add=False
+    a quantity of 0 removes the line.
+
+    Returns {variant_id: available} for the lines that couldn't be applied (available is
+    None for an unknown variant). Unless `partial`, any failure means nothing was applied.
+    """
+    try:
+        with transaction.atomic():
+            return _hold_cart_lines(cart_id, quantities, add, partial)
+    except LinesRejected as exc:
+        return exc.failures
+
+
+def _hold_cart_lines(cart_id, quantities, add, partial):
+    for attempt in range(2):
+        variants = {
+            variant.pk: variant
+            for variant in ProductVariant.objects.select_for_update().filter(pk__in=list(quantities)).order_by('pk')
+        }
+        items = {
+            item.variant_id: item
+            for item in CartItem.objects.select_for_update().filter(cart_id=cart_id, variant_id__in=list(variants))
+        }
+        failures = {variant_id: None for variant_id in quantities if variant_id not in variants}
+        targets, needs = {}, {}
+        for variant_id, variant in variants.items():
+            item = items.get(variant_id)
+            targets[variant_id] = (item.quantity if item and add else 0) + quantities[variant_id]
+            needs[variant_id] = targets[variant_id] - (item.reserved_quantity if item else 0)
+            if not variant.stock_shards and needs[variant_id] > variant.available_quantity:
+                failures[variant_id] = variant.available_quantity
+
+        short = [variant_id for variant_id, available in failures.items() if available is not None]
+        # abandoned carts may still be sitting on these variants: hand their expired holds back once
+        if attempt or not short or not release_expired_holds(variant_ids=short):
+            break
+
+    if failures and not partial:
+        raise LinesRejected(failures)
+
+    for variant_id, variant in variants.items():
+        need = needs[variant_id]
+        if variant_id in failures or not variant.stock_shards:
+            continue
+        if need > 0 and not claim_hot_stock(variant_id, variant.stock_shards, need):
+            available = reconcile_hot_variant(variant_id, claim=need)
+            if available < need:
+                failures[variant_id] = available
+                if not partial:
+                    raise LinesRejected(failures)
+        elif need < 0:
+            release_hot_stock(variant_id, variant.stock_shards, -need)
+
+    applied = [variant_id for variant_id in variants if variant_id not in failures]
+    adjust_reserved({variant_id: needs[variant_id] for variant_id in applied if not variants[variant_id].stock_shards})
+
+    expiry = reservation_expiry()
+    changed, created, removed = [], [], []
+    for variant_id in applied:
+        item, quantity = items.get(variant_id), targets[variant_id]
+        if not quantity:
+            if item:
+                removed.append(item.pk)
+        elif item:
+            item.quantity = item.reserved_quantity = quantity
+            item.reserved_until = expiry
+            changed.append(item)
+        else:
+            created.append(CartItem(cart_id=cart_id, variant_id=variant_id, quantity=quantity,
+                                    reserved_quantity=quantity, reserved_until=expiry))
+    CartItem.objects.bulk_update(changed, ['quantity', 'reserved_quantity', 'reserved_until'])
+    CartItem.objects.bulk_create(created)
+    CartItem.objects.filter(pk__in=removed).delete()
+    if applied:
+        Product.objects.filter(variants__in=applied).refresh_variant_summary()
+        Cart.objects.filter(pk=cart_id).refresh_totals()
+    return failures
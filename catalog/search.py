@@ -0,0 +1,154 @@
+import re
+import sqlite3
+from contextlib import closing
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+# Only word characters ever reach the engine's query syntax, so user input can't inject operators.
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+FTS_TABLE = 'catalog_product_fts'
+POSTGRES_CONFIG = 'english'
+
+
+def tokenize(term):
+    return TOKEN_RE.findall(term.lower())
+
+
+class BaseSearchBackend:
+    """
+    A search backend filters a Product queryset down to the matches for `term` and
+    annotates `search_rank` (higher is better). The last token is treated as a
+    prefix so the same call serves autocomplete.
+    """
+
+    def search(self, queryset, term):
+        raise NotImplementedError
+
+    def index_product(self, product):
+        # Called after a product is saved; backends backed by expression indexes need nothing.
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    # Fallback for databases without an inverted index: same scan DRF's SearchFilter does.
+
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return queryset.none()
+        for token in tokens:
+            queryset = queryset.filter(Q(product_name__icontains=token) | Q(description__icontains=token))
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SqliteFTSSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 table keyed by product id (rowid), kept in step by the Product signals.
+    Ranking is bm25 with the product name weighted above the description.
+    """
+    name_weight = 10.0
+    description_weight = 1.0
+
+    def match_expression(self, tokens):
+        *words, last = tokens
+        return ' '.join([f'"{word}"' for word in words] + [f'"{last}"*'])
+
+    def search(self, queryset, term):
+        tokens = tokenize(term)
+        if not tokens:
+            return queryset.none()
+        match = self.match_expression(tokens)
+        # bm25() is "lower is better", negate it so search_rank sorts like the other backends
+        rank = RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, %s, %s) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = catalog_product.id',
+            (self.name_weight, self.description_weight, match),
+            output_field=FloatField(),
+        )
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,))
+        ).annotate(search_rank=rank)
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, product_name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.product_name, product.description],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, product_name, description) '
+                'SELECT id, product_name, description FROM catalog_product'
+            )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    tsvector search against a GIN expression index over the same document (see
+    migration 0005), so Postgres maintains the index itself on every write.
+    """
+
+    def query_expression(self, tokens):
+        *words, last = tokens
+        return ' & '.join(words + [f'{last}:*'])
+
+    def search(self, queryset, term):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        tokens = tokenize(term)
+        if not tokens:
+            return queryset.none()
+        document = search_document()
+        query = SearchQuery(self.query_expression(tokens), search_type='raw', config=POSTGRES_CONFIG)
+        return queryset.alias(search_document=document).filter(search_document=query).annotate(
+            search_rank=SearchRank(document, query)
+        )
+
+
+def search_document():
+    # Shared by the Postgres backend and its GIN index so the planner can match them.
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('product_name', 'description', config=POSTGRES_CONFIG)
+
+
+def sqlite_has_fts5():
+    # Asked of a throwaway in-memory database on the same SQLite library rather than through Django's
+    # connection, so picking the backend runs no query: it may happen first in an async view.
+    with closing(sqlite3.connect(':memory:')) as database:
+        return 'ENABLE_FTS5' in {row[0] for row in database.execute('PRAGMA compile_options')}
+
+
+def load_search_backend():
+    # settings.CATALOG_SEARCH_BACKEND (dotted path) wins; otherwise pick by database vendor (no query).
+    dotted_path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    if dotted_path:
+        return import_string(dotted_path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite' and sqlite_has_fts5():
+        return SqliteFTSSearchBackend()
+    return LikeSearchBackend()
+
+
+search_backend = SimpleLazyObject(load_search_backend)
@@ -1,37 +1,109 @@
+from django.conf import settings
 from rest_framework import serializers
-from django.db import transaction
-from django.db.models import F
-from .models import Category, Product, ProductImage, ProductVariant, Cart, CartItem
+from .images import DEFAULT_THUMBNAIL_WIDTH, current_sizes, pick_derivative
+from .models import Category, Product, ProductImage, ProductVariant, Cart, CartItem, Order, OrderLine
+from .reservations import LineChanged, hold_cart_line, hold_cart_lines
 
 
 
 
+def media_url(path, context):
+    url = ProductImage._meta.get_field('image').storage.url(path)
+    request = context.get('request')
+    return request.build_absolute_uri(url) if request is not None else url
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    # {"webp": {"160": url, "320": url, ...}, "jpeg": {...}}; empty until the derivatives are generated
+    srcset = serializers.SerializerMethodField()
+
+    def get_srcset(self, image: ProductImage):
+        sizes = current_sizes(image.derivatives, image.image.name)
+        return {name: {width: media_url(path, self.context) for width, path in by_width.items()}
+                for name, by_width in sizes.items() if by_width}
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'srcset']
 
 class ProductVariantSerializer(serializers.ModelSerializer):
-    
+    # what shoppers can still add: on-hand stock minus active cart reservations
+    stock_quantity = serializers.IntegerField(source='available_quantity', read_only=True)
+
     class Meta:
         model = ProductVariant
         fields = ['id', 'size', 'color', 'price', 'stock_quantity']
 
+def parse_field_list(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    ?fields=a,b keeps only those fields; ?expand=x adds fields listed in
+    `expandable_fields`, which are left out by default. Views use
+    selected_fields() to decide which joins/prefetches are worth issuing.
+    """
+    expandable_fields = ()
+
+    @classmethod
+    def selected_fields(cls, query_params):
+        requested = parse_field_list(query_params.get('fields'))
+        if requested:
+            return [name for name in cls.Meta.fields if name in requested]
+        expand = parse_field_list(query_params.get('expand'))
+        return [name for name in cls.Meta.fields if name not in cls.expandable_fields or name in expand]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        selected = set(self.selected_fields(request.query_params))
+        for name in [name for name in self.fields if name not in selected]:
+            self.fields.pop(name)
+
+
 #for showing everything in one request 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     
     variants = ProductVariantSerializer(many=True, read_only=True)
     product_images = ProductImageSerializer(many=True, read_only=True)
-    category = serializers.StringRelatedField() # Display category name instead of ID (Note for self: Read Only field , switch to write_able if need be)
+    category = serializers.StringRelatedField() # Display category path (stored on the row, no parent walk) instead of ID (Note for self: Read Only field , switch to write_able if need be)
 
     class Meta:
         model = Product
         fields = ['id', 'product_name', 'slug', 'description', 'category', 'product_images', 'variants']
 
+# compact card for grid listings: price range and one thumbnail, nested data only on ?expand=
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+
+    variants = ProductVariantSerializer(many=True, read_only=True)
+    product_images = ProductImageSerializer(many=True, read_only=True)
+    category = serializers.StringRelatedField()
+    thumbnail = serializers.SerializerMethodField()
+
+    expandable_fields = ('description', 'product_images', 'variants')
+
+    def get_thumbnail(self, product: Product):
+        # first image, annotated by the view instead of prefetching every image: its card-sized
+        # derivative when generated, the original otherwise
+        width = getattr(settings, 'PRODUCT_THUMBNAIL_WIDTH', DEFAULT_THUMBNAIL_WIDTH)
+        original = getattr(product, 'thumbnail_path', None)
+        if not original:
+            return None
+        path = pick_derivative(getattr(product, 'thumbnail_derivatives', None), original, width) or original
+        return media_url(path, self.context)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'product_name', 'slug', 'category', 'min_price', 'max_price', 'in_stock', 'thumbnail',
+                  'description', 'product_images', 'variants']
+
 class SubCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ["id", "name", "slug"]
+        fields = ["id", "name", "slug", "full_name"]
 
 class CategorySerializer(serializers.ModelSerializer):
 
@@ -39,7 +111,7 @@ class CategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'subcategories']
+        fields = ['id', 'name', 'slug', 'full_name', 'subcategories']
 
 #FOR CART 
 
@@ -64,83 +136,42 @@ class CartItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model =  CartItem
-        fields = ['id', 'variant', 'quantity', 'total_price']
+        fields = ['id', 'variant', 'quantity', 'total_price', 'reserved_until']
 
 # Serializer for viewing the entire cart
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     grand_total = serializers.SerializerMethodField()
-    user = serializers.CharField(source='user.username', read_only=True) 
+    user = serializers.CharField(source='user.username', read_only=True, allow_null=True) # None for guest carts
 
     def get_grand_total(self, cart: Cart):
-        # Calculate the total price of all items in the cart
-        items = cart.items.all()
-        return sum((item.quantity * (item.variant.price if item.variant else 0)) for item in items)
+        # kept on the cart row by every cart mutation (CartQuerySet.refresh_totals)
+        return cart.subtotal
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'grand_total', 'created_at']
+        fields = ['id', 'user', 'items', 'item_count', 'grand_total', 'created_at']
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
     variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
 
-    def validate_variant_id(self, value):
-        #if variant exists
-        if not ProductVariant.objects.filter(pk = value).exists():
-            raise serializers.ValidationError("There is no variant with the given ID.")
-        return value
-
-    def validate(self, data):
-        # Basic positive quantity enforced by IntegerField(min_value=1)
-        return data
-    
     def save(self, **kwargs):
-        cart_id = self.context['cart_id']
+        # One conditional stock claim plus an upsert of the line; unknown variants surface here
+        # instead of in a separate exists() query up front.
         variant_id = self.validated_data['variant_id']
-        add_qty = self.validated_data['quantity']
-
-        with transaction.atomic():
-            variant = ProductVariant.objects.select_for_update().get(pk = variant_id)
-
-            if variant.stock_quantity < add_qty:
-                raise serializers.ValidationError(
-                    f"Not enough stock for {variant}. Available: {variant.stock_quantity}"
-                )
-            #locking existing cart for presetn item
-            cart_item = CartItem.objects.select_for_update().filter(cart_id=cart_id , variant_id=variant_id).first()
-
-            if cart_item:
-                new_qty = cart_item.quantity + add_qty
-               
-                #check against current 
-                if variant.stock_quantity < add_qty:
-                    # second check is redundant with earlier check but explicit.
-                    raise serializers.ValidationError(
-                        f"Not enough stock to add {add_qty}. Available: {variant.stock_quantity}"
-                    )
-               
-                # update quantity
-                cart_item.quantity = F('quantity') + add_qty
-                cart_item.save()
-                cart_item.refresh_from_db()
-            
-            else:
-                cart_item = CartItem.objects.create(
-                    cart_id=cart_id,
-                    variant_id=variant_id,
-                    quantity=add_qty
-                )  
-            # Decrement stock atomically
-            
-            ProductVariant.objects.filter(pk=variant_id).update(
-                stock_quantity=F('stock_quantity') - add_qty
-            )
-            variant.refresh_from_db()
-
-            self.instance = cart_item
-            return self.instance         
-        
+        try:
+            cart_item, available = hold_cart_line(self.context['cart_id'], variant_id, self.validated_data['quantity'])
+        except ProductVariant.DoesNotExist:
+            raise serializers.ValidationError({'variant_id': ["There is no variant with the given ID."]})
+        except LineChanged as exc:
+            raise serializers.ValidationError(str(exc))
+        if cart_item is None:
+            raise serializers.ValidationError(f"Not enough stock for this variant. Available: {available}")
+
+        self.instance = cart_item
+        return self.instance
 
     class Meta:
         model = CartItem
@@ -155,49 +186,83 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['quantity']
 
-    def validate_quantity(self, value):
-        # If increasing quantity, ensure enough stock exists
-        current_qty = self.instance.quantity
-        if value > current_qty:
-            # need extra units
-            need = value - current_qty
-            variant = ProductVariant.objects.filter(pk=self.instance.variant_id).first()
-            if not variant:
-                raise serializers.ValidationError("Variant no longer exists.")
-            if variant.stock_quantity < need:
-                raise serializers.ValidationError(f"Not enough stock. Available: {variant.stock_quantity}")
-        return value
-
     def save(self, **kwargs):
         """
-        Adjust stock depending on delta:
-          - if quantity increased: decrement stock by delta
-          - if decreased: increment stock by (-delta)
-        All done inside a transaction with select_for_update on variant and cart_item.
+        Adjust the line's stock hold to the new quantity and renew its expiry:
+          - if it needs more units than it holds: claim the difference
+          - if fewer: release the difference
+        See hold_cart_line() for how this works without locking the variant up front.
         """
-        new_qty = self.validated_data['quantity']
         cart_item = self.instance
-        delta = new_qty - cart_item.quantity  # positive -> need more; negative -> release
+        try:
+            updated, available = hold_cart_line(cart_item.cart_id, cart_item.variant_id,
+                                                self.validated_data['quantity'], add=False)
+        except ProductVariant.DoesNotExist:
+            raise serializers.ValidationError("Variant no longer exists.")
+        except LineChanged as exc:
+            raise serializers.ValidationError(str(exc))
+        if updated is None:
+            raise serializers.ValidationError(f"Not enough stock. Available: {available}")
 
-        with transaction.atomic():
-            variant = ProductVariant.objects.select_for_update().get(pk=cart_item.variant_id)
+        self.instance = updated
+        return updated
 
-            if delta > 0:
-                # trying to increase quantity
-                if variant.stock_quantity < delta:
-                    raise serializers.ValidationError(f"Not enough stock. Available: {variant.stock_quantity}")
-                # decrement stock
-                ProductVariant.objects.filter(pk=variant.pk).update(stock_quantity=F('stock_quantity') - delta)
-            elif delta < 0:
-                # releasing stock
-                ProductVariant.objects.filter(pk=variant.pk).update(stock_quantity=F('stock_quantity') + (-delta))
 
-            # update cart item quantity
-            cart_item.quantity = new_qty
-            cart_item.save()
-            cart_item.refresh_from_db()
 
-        return cart_item
+class BulkCartLineSerializer(serializers.Serializer):
+    variant_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
 
+# Serializer for adding/setting many cart lines in one request ("buy the look", reorder, cart merge)
 
+class BulkCartItemSerializer(serializers.Serializer):
+    items = BulkCartLineSerializer(many=True, allow_empty=False, max_length=100)
+    # add: increase each line by quantity; set: make each line exactly quantity (0 removes it)
+    mode = serializers.ChoiceField(choices=['add', 'set'], default='add')
+    # true: every line or none is applied; false: apply what fits and report the rest in `rejected`
+    atomic = serializers.BooleanField(default=True)
 
+    def validate(self, data):
+        if data['mode'] == 'add' and any(line['quantity'] < 1 for line in data['items']):
+            raise serializers.ValidationError({'items': ["Quantities must be at least 1 when adding."]})
+        return data
+
+    def save(self, **kwargs):
+        quantities = {}
+        for line in self.validated_data['items']:
+            # repeated variants: adds accumulate, the last set wins
+            previous = quantities.get(line['variant_id'], 0) if self.validated_data['mode'] == 'add' else 0
+            quantities[line['variant_id']] = previous + line['quantity']
+
+        failures = hold_cart_lines(self.context['cart_id'], quantities,
+                                   add=self.validated_data['mode'] == 'add',
+                                   partial=not self.validated_data['atomic'])
+        self.rejected = [
+            {'variant_id': variant_id, 'detail': self.failure_message(available)}
+            for variant_id, available in failures.items()
+        ]
+        if self.rejected and self.validated_data['atomic']:
+            raise serializers.ValidationError({'rejected': self.rejected})
+        return self.rejected
+
+    @staticmethod
+    def failure_message(available):
+        if available is None:
+            return "There is no variant with the given ID."
+        return f"Not enough stock. Available: {available}"
+
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['id', 'variant', 'product_name', 'size', 'color', 'unit_price', 'quantity']
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'lines', 'item_count', 'total', 'created_at']
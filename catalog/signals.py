@@ -0,0 +1,110 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import load_user, revoke_user
+from .caching import bump_catalog_version
+from .carts import forget_cart_id
+from .images import release_image, schedule_derivatives
+from .models import Cart, CartItem, Category, Product, ProductImage, ProductVariant
+from .reservations import release_cart_lines
+from .search import search_backend
+from .stock import reconcile_hot_variant
+from .tree import invalidate_category_tree
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    invalidate_category_tree()
+    # drop it again once committed, in case a reader re-cached rows from inside the transaction
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    # incremental search index update, one row per save
+    search_backend.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    search_backend.remove_product(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+def catalog_changed(sender, **kwargs):
+    # new version -> new response cache keys and ETags for every catalogue endpoint
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_init, sender=ProductImage)
+def product_image_loaded(sender, instance, **kwargs):
+    # the stored name as loaded from the database (no query when deferred), to spot replaced uploads
+    instance._stored_image = instance.__dict__.get('image') if instance.pk is not None else None
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, **kwargs):
+    # new or replaced upload: resize it in the background pool once committed
+    if instance.image and (instance.derivatives or {}).get('source') != instance.image.name:
+        schedule_derivatives(instance.pk)
+    previous, instance._stored_image = instance._stored_image, instance.image.name
+    if previous and previous != instance.image.name:
+        transaction.on_commit(partial(release_image, previous, instance.derivatives))
+
+
+@receiver(post_delete, sender=ProductImage)
+def product_image_deleted(sender, instance, **kwargs):
+    transaction.on_commit(partial(release_image, instance.image.name, instance.derivatives))
+
+
+@receiver(pre_delete, sender=ProductVariant)
+def variant_deleting(sender, instance, **kwargs):
+    # the carts holding it, read before the cascade takes their lines with it
+    instance._cart_ids = list(Cart.objects.filter(items__variant=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=ProductVariant)
+def variant_deleted(sender, instance, **kwargs):
+    # every delete path (instance, queryset, admin bulk action, product cascade) ends here; once it
+    # commits, the product's price range and in_stock flag and the carts' totals stop counting the variant
+    transaction.on_commit(partial(refresh_after_variant_delete, instance.product_id, instance._cart_ids))
+
+
+def refresh_after_variant_delete(product_id, cart_ids):
+    Product.objects.filter(pk=product_id).refresh_variant_summary()
+    if cart_ids:
+        Cart.objects.filter(pk__in=cart_ids).refresh_totals()
+
+
+@receiver(post_save, sender=ProductVariant)
+def hot_variant_saved(sender, instance, **kwargs):
+    # restocks and edits of a hot variant are redistributed over its buckets
+    if instance.stock_shards:
+        reconcile_hot_variant(instance.pk)
+
+
+@receiver(pre_delete, sender=Cart)
+def cart_deleted(sender, instance, **kwargs):
+    # the cascade (e.g. account deletion) would drop the lines without giving their holds back
+    release_cart_lines(CartItem.objects.filter(cart=instance), delete=True)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_removed(sender, instance, **kwargs):
+    forget_cart_id(instance)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # stateless tokens carry no account state: deactivated or deleted users are denylisted instead
+    load_user.cache_clear()
+    if kwargs.get('signal') is post_delete or not instance.is_active:
+        revoke_user(instance.pk)
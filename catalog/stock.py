@@ -0,0 +1,152 @@
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .caching import bump_stock_version
+from .models import CartItem, Product, ProductVariant, StockBucket
+
+
+def adjust_reserved(totals):
+    """
+    Apply {variant_id: delta} to reserved_quantity for any number of variants in one
+    UPDATE with a CASE expression (negative deltas release holds).
+    """
+    totals = {variant_id: delta for variant_id, delta in totals.items() if delta}
+    if not totals:
+        return 0
+    delta = Case(
+        *[When(pk=variant_id, then=Value(amount)) for variant_id, amount in totals.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+    transaction.on_commit(bump_stock_version)
+    return ProductVariant.objects.filter(pk__in=list(totals)).update(reserved_quantity=F('reserved_quantity') + delta)
+
+
+def claim_stock(variant_id, quantity):
+    """
+    Reserve `quantity` units of a regular variant with a single conditional UPDATE
+    (`... WHERE stock_quantity >= reserved_quantity + quantity`): the row is never read
+    or locked beforehand. False if the variant is short, missing or hot.
+    """
+    claimed = ProductVariant.objects.filter(
+        pk=variant_id, stock_shards=0, stock_quantity__gte=F('reserved_quantity') + quantity
+    ).update(reserved_quantity=F('reserved_quantity') + quantity)
+    if claimed:
+        transaction.on_commit(bump_stock_version)
+    return bool(claimed)
+
+
+def commit_stock(totals, hot=()):
+    """
+    Turn held units into sold ones, {variant_id: quantity}, in one UPDATE: on-hand stock
+    goes down, and so does reserved_quantity except for the `hot` variants (their holds
+    live in the buckets and reserved_quantity is recomputed when reconciled).
+    """
+    totals = {variant_id: quantity for variant_id, quantity in totals.items() if quantity}
+    if not totals:
+        return 0
+
+    def per_variant(amounts):
+        return Case(
+            *[When(pk=variant_id, then=Value(amount)) for variant_id, amount in amounts.items()],
+            default=Value(0), output_field=IntegerField(),
+        )
+    transaction.on_commit(bump_stock_version)
+    return ProductVariant.objects.filter(pk__in=list(totals)).update(
+        stock_quantity=F('stock_quantity') - per_variant(totals),
+        reserved_quantity=F('reserved_quantity') - per_variant(
+            {variant_id: quantity for variant_id, quantity in totals.items() if variant_id not in hot}
+        ),
+    )
+
+
+def release_stock(totals):
+    """
+    Give held units back, {variant_id: quantity}. Regular variants get one grouped
+    UPDATE on reserved_quantity; hot variants get the units back in a random bucket.
+    """
+    totals = {variant_id: quantity for variant_id, quantity in totals.items() if quantity}
+    if not totals:
+        return
+    shards = dict(ProductVariant.objects.filter(pk__in=list(totals), stock_shards__gt=0).values_list('pk', 'stock_shards'))
+    adjust_reserved({variant_id: -quantity for variant_id, quantity in totals.items() if variant_id not in shards})
+    for variant_id, shard_count in shards.items():
+        release_hot_stock(variant_id, shard_count, totals[variant_id])
+
+
+# --- Hot variants -------------------------------------------------------------
+#
+# For a hot variant the available units live in `stock_shards` StockBucket rows instead
+# of being derived from the variant row. Adding to a cart claims units from one bucket
+# with `UPDATE ... SET quantity = quantity - n WHERE quantity >= n`, which only locks that
+# bucket, so N buckets let N adds proceed at once. The variant's reserved_quantity is
+# not touched on that path; reconcile_hot_variant() recomputes it from the cart holds and
+# redistributes what is left across the buckets (run it periodically, and it runs
+# automatically when a claim finds every bucket short or the variant is edited).
+
+def claim_hot_stock(variant_id, shard_count, quantity):
+    """Take `quantity` units from one bucket, trying them in random order. True on success."""
+    indexes = list(range(shard_count))
+    random.shuffle(indexes)
+    for index in indexes:
+        claimed = StockBucket.objects.filter(variant_id=variant_id, index=index, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity
+        )
+        if claimed:
+            transaction.on_commit(bump_stock_version)
+            return True
+    return False
+
+
+def release_hot_stock(variant_id, shard_count, quantity):
+    StockBucket.objects.filter(variant_id=variant_id, index=random.randrange(shard_count)).update(
+        quantity=F('quantity') + quantity
+    )
+    transaction.on_commit(bump_stock_version)
+
+
+def hot_available(variant_id):
+    return StockBucket.objects.filter(variant_id=variant_id).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def reconcile_hot_variant(variant_id, claim=0):
+    """
+    Recompute reserved_quantity from the cart holds and spread the remaining available
+    units evenly over the buckets. With `claim`, that many units are taken out first
+    (if there are enough), so a claim larger than any one bucket can still succeed.
+    Returns the available total before the claim.
+    """
+    with transaction.atomic():
+        variant = ProductVariant.objects.select_for_update().get(pk=variant_id)
+        buckets = list(StockBucket.objects.select_for_update().filter(variant_id=variant_id).order_by('index'))
+        reserved = CartItem.objects.filter(variant_id=variant_id).aggregate(total=Sum('reserved_quantity'))['total'] or 0
+        available = max(variant.stock_quantity - reserved, 0)
+        remaining = available - claim if claim <= available else available
+
+        ProductVariant.objects.filter(pk=variant_id).update(reserved_quantity=reserved)
+        transaction.on_commit(bump_stock_version)
+        if buckets:
+            share, remainder = divmod(remaining, len(buckets))
+            for bucket in buckets:
+                bucket.quantity = share + (1 if bucket.index < remainder else 0)
+            StockBucket.objects.bulk_update(buckets, ['quantity'])
+        Product.objects.filter(pk=variant.product_id).refresh_variant_summary()
+    return available
+
+
+def designate_hot_variant(variant_id, shard_count=8):
+    # Split the variant's available stock across `shard_count` buckets.
+    with transaction.atomic():
+        ProductVariant.objects.select_for_update().filter(pk=variant_id).update(stock_shards=shard_count)
+        StockBucket.objects.filter(variant_id=variant_id).delete()
+        StockBucket.objects.bulk_create([StockBucket(variant_id=variant_id, index=index) for index in range(shard_count)])
+        return reconcile_hot_variant(variant_id)
+
+
+def undesignate_hot_variant(variant_id):
+    # Back to a single row: the reconciled reserved_quantity is all the regular path needs.
+    with transaction.atomic():
+        reconcile_hot_variant(variant_id)
+        ProductVariant.objects.filter(pk=variant_id).update(stock_shards=0)
+        StockBucket.objects.filter(variant_id=variant_id).delete()
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+# Product images are stored under the SHA-256 of their bytes, e.g.
+# products/9f/9f86d081...0a08.jpg: identical uploads share one file, and since a name
+# can never point at other content it is served with far-future, immutable cache headers.
+BLOB_DIR = 'products'
+HASH_CHUNK = 64 * 1024
+CONTENT_ADDRESSED = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/(?:derived/)?[0-9a-f]{{64}}[-\w]*(?:\.[a-z0-9]+)?$')
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_ADDRESSED.match(name))
+
+
+def blob_name(digest, original_name):
+    extension = posixpath.splitext(original_name)[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,8}', extension):
+        extension = ''
+    return posixpath.join(BLOB_DIR, digest[:2], digest + extension)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names uploads after the SHA-256 of their content (keeping the
+    extension). Saving bytes that are already stored writes nothing and returns the
+    existing name; nothing is ever overwritten with different content.
+    Files saved under an explicit content-addressed name (derivatives) are stored as given.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # the final name comes from the content, in _save()
+        return name
+
+    def _save(self, name, content):
+        if is_content_addressed(name):
+            return self._store(name, content)
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK):
+            digest.update(chunk)
+        content.seek(0)
+        return self._store(blob_name(digest.hexdigest(), name), content)
+
+    def _store(self, name, content):
+        if self.exists(name):
+            # a deduplicated upload: refresh the mtime so a concurrent release of the
+            # last previous reference leaves the file alone (see catalog.images.release_image)
+            os.utime(self.path(name))
+            return name
+        # written under a unique temporary name and renamed into place, so readers never
+        # see a partial file and racing writers of the same content both succeed
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+def product_image_storage():
+    return _product_image_storage
+
+
+_product_image_storage = ContentAddressedStorage()
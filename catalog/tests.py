@@ -1,3 +1,1291 @@
-from django.test import TestCase
+import hashlib
+import inspect
+import io
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import empty
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import purge_revoked_tokens, revoke_token
+from .caching import CATALOG_RECENT_BUMP_KEY, bump_catalog_version, fill_reads, get_catalog_version
+from .carts import aget_cart_id, cart_id_key, get_cart_id, merge_carts
+from .db import PrimaryReplicaRouter, _request_state, cart_owner, replica_pin_key, retry_on_busy
+from .images import derivative_paths
+from .models import (Cart, CartItem, Category, Order, Product, ProductImage, ProductVariant, RevokedToken,
+                     StockBucket)
+from .reservations import hold_cart_line, release_cart_lines, release_expired_holds
+from .search import (LikeSearchBackend, PostgresSearchBackend, SqliteFTSSearchBackend, search_backend,
+                     sqlite_has_fts5)
+from .stock import (designate_hot_variant, hot_available, reconcile_hot_variant, release_stock,
+                    undesignate_hot_variant)
+from .tree import get_category_tree
+from .views import serve_media
+
+
+class CategoryPathTests(TestCase):
+    """Categories store their materialized path, depth and display name, rewritten subtree-wide on a move."""
+
+    def setUp(self):
+        self.clothing = Category.objects.create(name='Clothing', slug='clothing')
+        self.tops = Category.objects.create(name='Tops', slug='tops', parent_category=self.clothing)
+        self.shirts = Category.objects.create(name='Shirts', slug='shirts', parent_category=self.tops)
+
+    def test_tree_columns(self):
+        self.assertEqual(self.shirts.path, f'{self.clothing.pk:08d}/{self.tops.pk:08d}/{self.shirts.pk:08d}/')
+        self.assertEqual(self.shirts.depth, 2)
+        self.assertEqual(self.shirts.get_breadcrumbs(), ['Clothing', 'Tops', 'Shirts'])
+        self.assertEqual(self.shirts.get_ancestor_ids(), [self.clothing.pk, self.tops.pk])
+        self.assertEqual(list(self.clothing.get_descendants()), [self.tops, self.shirts])
+
+    def test_rename_rewrites_descendants(self):
+        self.clothing.name = 'Apparel'
+        self.clothing.save()
+        self.shirts.refresh_from_db()
+        self.assertEqual(str(self.shirts), 'Apparel -> Tops -> Shirts')
+
+    def test_move_rewrites_subtree(self):
+        sale = Category.objects.create(name='Sale', slug='sale')
+        self.tops.parent_category = sale
+        self.tops.save()
+        self.shirts.refresh_from_db()
+        self.assertEqual(self.shirts.path, f'{sale.pk:08d}/{self.tops.pk:08d}/{self.shirts.pk:08d}/')
+        self.assertEqual((self.shirts.depth, self.shirts.full_name), (2, 'Sale -> Tops -> Shirts'))
+        self.assertEqual(list(self.clothing.get_descendants()), [])
+
+    def test_cannot_move_under_own_descendant(self):
+        self.clothing.parent_category = self.shirts
+        with self.assertRaises(ValidationError):
+            self.clothing.full_clean()
+
+
+class CategoryTreeTests(TestCase):
+    """The full-depth menu tree is one query, cached until a category changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.clothing = Category.objects.create(name='Clothing', slug='clothing')
+        tops = Category.objects.create(name='Tops', slug='tops', parent_category=self.clothing)
+        Category.objects.create(name='Shirts', slug='shirts', parent_category=tops)
+
+    def test_tree_is_nested_to_full_depth(self):
+        tree = self.client.get('/api/categories/tree/').json()
+        self.assertEqual([node['slug'] for node in tree], ['clothing'])
+        shirts = tree[0]['subcategories'][0]['subcategories'][0]
+        self.assertEqual((shirts['slug'], shirts['full_name'], shirts['subcategories']),
+                         ('shirts', 'Clothing -> Tops -> Shirts', []))
+
+    def test_cached_until_a_category_changes(self):
+        with self.assertNumQueries(1):
+            get_category_tree()
+        with self.assertNumQueries(0):
+            get_category_tree()
+        Category.objects.create(name='Shoes', slug='shoes', parent_category=self.clothing)
+        self.assertEqual([node['slug'] for node in get_category_tree()[0]['subcategories']], ['tops', 'shoes'])
+
+
+def listed_slugs(response):
+    return [product['slug'] for product in response.json()['results']]
+
+
+class CategoryFilterTests(TestCase):
+    """?category= matches products anywhere in the category's subtree."""
+
+    def setUp(self):
+        cache.clear()
+        clothing = Category.objects.create(name='Clothing', slug='clothing')
+        shirts = Category.objects.create(name='Shirts', slug='shirts', parent_category=clothing)
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for slug, category in (('coat', clothing), ('oxford', shirts), ('loafer', shoes)):
+            Product.objects.create(product_name=slug.title(), slug=slug, category=category)
+
+    def test_subtree(self):
+        self.assertEqual(sorted(listed_slugs(self.client.get('/api/products/?category=clothing'))), ['coat', 'oxford'])
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?category=shirts')), ['oxford'])
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?category=unknown')), [])
+
+
+class PriceSummaryTests(TestCase):
+    """min_price/max_price/in_stock follow the variants and drive price filters and ordering."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Bags', slug='bags')
+        self.tote = Product.objects.create(product_name='Tote', slug='tote', category=category)
+        self.clutch = Product.objects.create(product_name='Clutch', slug='clutch', category=category)
+        self.small = ProductVariant.objects.create(product=self.tote, size='S', color='Tan', price='20.00', stock_quantity=0)
+        ProductVariant.objects.create(product=self.tote, size='L', color='Tan', price='35.00', stock_quantity=2)
+        ProductVariant.objects.create(product=self.clutch, size='M', color='Red', price='50.00', stock_quantity=1)
+
+    def summary(self, product):
+        return Product.objects.values_list('min_price', 'max_price', 'in_stock').get(pk=product.pk)
+
+    def test_summary_follows_variants(self):
+        self.assertEqual(self.summary(self.tote), (Decimal('20.00'), Decimal('35.00'), True))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.get(product=self.tote, size='L').delete()
+        self.assertEqual(self.summary(self.tote), (Decimal('20.00'), Decimal('20.00'), False))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.small.delete()
+        self.assertEqual(self.summary(self.tote), (None, None, False))
+
+    def test_bulk_deletes_refresh_the_summary(self):
+        # queryset deletes and the admin's bulk action don't call Model.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(pk=self.small.pk).delete()
+        self.assertEqual(self.summary(self.tote), (Decimal('35.00'), Decimal('35.00'), True))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(product__in=[self.tote, self.clutch]).delete()
+        self.assertEqual((self.summary(self.tote), self.summary(self.clutch)), ((None, None, False),) * 2)
+
+    def test_filters_and_ordering_use_the_summary(self):
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?variants__price__gte=40')), ['clutch'])
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?variants__price__lte=25')), ['tote'])
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?ordering=variants__price')), ['tote', 'clutch'])
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?ordering=-variants__price')), ['clutch', 'tote'])
+
+
+class KeysetPaginationTests(TestCase):
+    """?cursor= pages seek past the last row served: stable under inserts, no COUNT unless asked."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Socks', slug='socks')
+        for index in range(25):
+            Product.objects.create(product_name=f'Sock {index}', slug=f'sock-{index}', category=self.category)
+
+    def test_pages_are_stable_while_rows_are_inserted(self):
+        first = self.client.get('/api/products/?cursor=').json()  # newest first
+        self.assertNotIn('count', first)
+        # sorts before the cursor: with OFFSET every later page would shift and repeat a row
+        Product.objects.create(product_name='Late sock', slug='late-sock', category=self.category)
+
+        seen = [product['slug'] for product in first['results']]
+        next_link = first['next']
+        while next_link:
+            page = self.client.get(next_link).json()
+            seen += [product['slug'] for product in page['results']]
+            next_link = page['next']
+        self.assertEqual(seen, [f'sock-{index}' for index in reversed(range(25))])
+
+    def test_ties_are_broken_by_id(self):
+        # every min_price is NULL (no variants): only the id tie-breaker orders them
+        seen, next_link = [], '/api/products/?ordering=min_price&cursor='
+        while next_link:
+            page = self.client.get(next_link).json()
+            seen += [product['slug'] for product in page['results']]
+            next_link = page['next']
+        self.assertEqual(seen, [f'sock-{index}' for index in range(25)])
+
+    def test_count_on_request(self):
+        self.assertEqual(self.client.get('/api/products/?cursor=&count=true').json()['count'], 25)
+
+    def test_bad_cursor_is_404(self):
+        self.assertEqual(self.client.get('/api/products/?cursor=not-a-cursor').status_code, 404)
+        # a cursor for another ordering
+        next_link = self.client.get('/api/products/?ordering=min_price&cursor=').json()['next']
+        cursor = parse_qs(urlsplit(next_link).query)['cursor'][0]
+        response = self.client.get('/api/products/', {'ordering': '-max_price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(TestCase):
+    """?search= goes through the configured index backend, best matches first, last word as a prefix."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Knitwear', slug='knitwear')
+        self.products = {
+            slug: Product.objects.create(product_name=name, slug=slug, category=category, description=description)
+            for slug, name, description in (
+                ('cardigan', 'Wool cardigan', 'Soft merino.'),
+                ('jumper', 'Cotton jumper', 'Pairs well with a wool scarf.'),
+                ('beanie', 'Beanie', 'Acrylic.'),
+            )
+        }
+
+    def search(self, backend, term):
+        return [product.slug for product in backend.search(Product.objects.all(), term).order_by('-search_rank', 'pk')]
+
+    def test_fts_backend(self):
+        if connection.vendor != 'sqlite' or not sqlite_has_fts5():
+            self.skipTest('SQLite without FTS5')
+        backend = SqliteFTSSearchBackend()
+        self.assertEqual(self.search(backend, 'wool'), ['cardigan', 'jumper'])  # name outranks description
+        self.assertEqual(self.search(backend, 'cardi'), ['cardigan'])  # prefix on the last word
+        self.assertEqual(self.search(backend, 'beanie OR "wool*'), [])  # operators and quotes are plain words
+
+        self.products['beanie'].product_name = 'Wool beanie'
+        self.products['beanie'].save()  # re-indexed by the signal
+        self.assertIn('beanie', self.search(backend, 'wool'))
+        self.products['cardigan'].delete()
+        self.assertEqual(self.search(backend, 'cardi'), [])
+
+    def test_like_backend(self):
+        backend = LikeSearchBackend()
+        self.assertEqual(self.search(backend, 'wool'), ['cardigan', 'jumper'])
+        self.assertFalse(backend.search(Product.objects.all(), '***').exists())
+
+    def test_postgres_query_syntax(self):
+        self.assertEqual(PostgresSearchBackend().query_expression(['wool', 'card']), 'wool & card:*')
+
+    def test_search_endpoint(self):
+        self.assertEqual(listed_slugs(self.client.get('/api/products/?search=cotton')), ['jumper'])
+
+
+class FacetTests(TestCase):
+    """/api/products/facets/ counts distinct products per value, for the listing's filters, in four queries."""
+
+    def setUp(self):
+        cache.clear()
+        clothing = Category.objects.create(name='Clothing', slug='clothing')
+        shirts = Category.objects.create(name='Shirts', slug='shirts', parent_category=clothing)
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for slug, category, variants in (
+            ('oxford', shirts, (('M', 'Blue', '30.00'), ('L', 'Blue', '30.00'))),
+            ('tee', shirts, (('M', 'White', '12.00'),)),
+            ('loafer', shoes, (('42', 'Brown', '120.00'),)),
+        ):
+            product = Product.objects.create(product_name=slug.title(), slug=slug, category=category)
+            for size, color, price in variants:
+                ProductVariant.objects.create(product=product, size=size, color=color, price=price, stock_quantity=3)
+
+    def test_counts(self):
+        with self.assertNumQueries(4):
+            facets = self.client.get('/api/products/facets/').json()
+        self.assertEqual([(row['slug'], row['count']) for row in facets['categories']], [('shirts', 2), ('shoes', 1)])
+        self.assertEqual({row['value']: row['count'] for row in facets['sizes']}, {'42': 1, 'L': 1, 'M': 2})
+        self.assertEqual({row['value']: row['count'] for row in facets['colors']}, {'Blue': 1, 'Brown': 1, 'White': 1})
+        self.assertEqual([row['count'] for row in facets['price']], [1, 1, 0, 1, 0, 0, 0])
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/products/facets/')  # cached per filter set
+
+    def test_follows_filters(self):
+        facets = self.client.get('/api/products/facets/?category=clothing&variants__price__gte=20').json()
+        self.assertEqual([(row['slug'], row['count']) for row in facets['categories']], [('shirts', 1)])
+        self.assertEqual({row['value'] for row in facets['colors']}, {'Blue'})
+
+
+class ResponseCacheTests(TestCase):
+    """Catalogue GETs carry a versioned ETag: 304s and cached bodies cost no queries until the catalogue changes."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Hats', slug='hats')
+        self.product = Product.objects.create(product_name='Fedora', slug='fedora', category=category)
+
+    def test_not_modified_and_replay(self):
+        response = self.client.get('/api/products/?ordering=min_price&in_stock=false')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            # same ETag whatever the parameter order
+            replayed = self.client.get('/api/products/?in_stock=false&ordering=min_price')
+            not_modified = self.client.get('/api/products/?in_stock=false&ordering=min_price', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(replayed.content, response.content)
+        self.assertEqual(replayed['ETag'], etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_writes_invalidate(self):
+        etag = self.client.get(f'/api/products/{self.product.pk}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.product_name = 'Trilby'
+            self.product.save()
+
+        response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['product_name'], 'Trilby')
+
+    def test_holds_refresh_stock_levels(self):
+        variant = ProductVariant.objects.create(product=self.product, size='M', color='Black', price='40.00',
+                                                stock_quantity=10)
+        cart = Cart.objects.create(user=User.objects.create_user('milliner'))
+        detail = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(detail.json()['variants'][0]['stock_quantity'], 10)
+        listing = self.client.get('/api/products/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_cart_line(cart.pk, variant.pk, 5)  # still in stock: the summary doesn't move
+
+        response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], detail['ETag'])
+        self.assertEqual(response.json()['variants'][0]['stock_quantity'], 5)
+        expanded = self.client.get('/api/products/?expand=variants').json()['results'][0]
+        self.assertEqual(expanded['variants'][0]['stock_quantity'], 5)
+        # compact cards show no stock level and stay cached
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=listing['ETag']).status_code, 304)
+
+    @override_settings(ALLOWED_HOSTS=['shop.example', 'testserver'])
+    def test_host_is_part_of_the_key(self):
+        for index in range(11):
+            Product.objects.create(product_name=f'Cap {index}', slug=f'cap-{index}', category=self.product.category)
+        here = self.client.get('/api/products/')
+        there = self.client.get('/api/products/', HTTP_HOST='shop.example')
+        self.assertNotEqual(here['ETag'], there['ETag'])
+        self.assertTrue(there.json()['next'].startswith('http://shop.example/'))
+
+
+class SparseFieldsetTests(TestCase):
+    """Listings return compact cards; ?fields= trims them and ?expand= adds the nested data, with the joins to match."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Socks', slug='socks')
+        self.product = Product.objects.create(product_name='Ankle sock', slug='ankle-sock', category=category,
+                                              description='Cotton.')
+        ProductVariant.objects.create(product=self.product, size='M', color='Black', price='4.00', stock_quantity=9)
+
+    def test_compact_listing(self):
+        card = self.client.get('/api/products/').json()['results'][0]
+        self.assertEqual(card['min_price'], '4.00')
+        self.assertTrue(card['in_stock'])
+        self.assertNotIn('variants', card)
+        self.assertNotIn('description', card)
+
+        card = self.client.get('/api/products/?expand=variants,description').json()['results'][0]
+        self.assertEqual([variant['color'] for variant in card['variants']], ['Black'])
+        self.assertEqual(card['description'], 'Cotton.')
+
+    def test_fields(self):
+        with self.assertNumQueries(2) as queries:  # count and page
+            response = self.client.get('/api/products/?fields=id,product_name,unknown')
+        self.assertNotIn('catalog_category', queries[1]['sql'])
+        self.assertNotIn('catalog_productimage', queries[1]['sql'])
+        self.assertEqual(response.json()['results'], [{'id': self.product.pk, 'product_name': 'Ankle sock'}])
+
+        detail = self.client.get(f'/api/products/{self.product.pk}/?fields=slug,variants').json()
+        self.assertEqual(set(detail), {'slug', 'variants'})
+
+
+class FastSerializationTests(TestCase):
+    """The fast-path serializer renders exactly the bytes the DRF serializers would."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Scarves', slug='scarves')
+        for index in range(3):
+            product = Product.objects.create(product_name=f'Scarf {index}', slug=f'scarf-{index}', category=category,
+                                             description='' if index else 'Long.')
+            ProductVariant.objects.create(product=product, size='OS', color='Red', price=f'{index + 9}.50', stock_quantity=index)
+        self.variant = ProductVariant.objects.filter(stock_quantity__gt=0).first()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('scarf-knitter'))
+
+    def render_both(self, path, **headers):
+        rendered = []
+        for enabled in (True, False):
+            cache.clear()
+            with override_settings(CATALOG_FAST_SERIALIZATION=enabled):
+                response = self.client.get(path, **headers)
+            self.assertEqual(response.status_code, 200)
+            rendered.append(response.content)
+        return rendered
+
+    def test_listing(self):
+        for path in ('/api/products/', '/api/products/?expand=description,variants,product_images',
+                     '/api/products/?fields=id,min_price,category'):
+            fast, drf = self.render_both(path)
+            self.assertEqual(fast, drf, path)
+
+    def test_cart(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': 1})
+        fast, drf = self.render_both('/api/cart/')
+        self.assertEqual(fast, drf)
+        self.assertEqual(len(json.loads(fast)['items']), 1)
+
+
+class ReservationTests(TestCase):
+    """Cart lines hold stock in reserved_quantity until they expire, are removed or checked out."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Hats', slug='hats')
+        self.product = Product.objects.create(product_name='Beanie', slug='beanie', category=category)
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='Grey', price='15.00',
+                                                     stock_quantity=10)
+        self.cart = Cart.objects.create(user=User.objects.create_user('knitter'))
+
+    def reserved(self):
+        return ProductVariant.objects.values_list('reserved_quantity', flat=True).get(pk=self.variant.pk)
+
+    def add(self, user, quantity):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': quantity})
+
+    def test_hold_and_expiry_sweep(self):
+        self.assertEqual(self.add(self.cart.user, 4).status_code, 201)
+        self.assertEqual(self.reserved(), 4)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_quantity, 6)
+
+        self.assertEqual(release_expired_holds(), 0)  # not expired yet
+        call_command('release_expired_reservations', stdout=io.StringIO())
+        self.assertEqual(self.reserved(), 4)
+
+        CartItem.objects.update(reserved_until=timezone.now() - timedelta(seconds=1))
+        out = io.StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('Released 1 expired', out.getvalue())
+        self.assertEqual(self.reserved(), 0)
+        line = CartItem.objects.get(cart=self.cart)  # the line stays in the cart, without a hold
+        self.assertEqual((line.quantity, line.reserved_quantity, line.reserved_until), (4, 0, None))
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).stock_quantity, 10)
+
+    def test_short_stock_takes_back_expired_holds(self):
+        abandoner = User.objects.create_user('abandoner')
+        self.add(abandoner, 8)
+        response = self.add(self.cart.user, 5)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 2', response.content.decode())
+
+        CartItem.objects.filter(cart__user=abandoner).update(reserved_until=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.add(self.cart.user, 5).status_code, 201)
+        self.assertEqual(self.reserved(), 5)
+        self.assertEqual(CartItem.objects.get(cart__user=abandoner).reserved_quantity, 0)
+
+    def test_lowering_a_line_releases_units(self):
+        self.add(self.cart.user, 6)
+        client = APIClient()
+        client.force_authenticate(self.cart.user)
+        line = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(client.patch(f'/api/cart/items/{line.pk}/', {'quantity': 2}).status_code, 200)
+        self.assertEqual(self.reserved(), 2)
+
+    def test_holds_bump_the_catalogue_only_when_a_summary_moves(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_cart_line(self.cart.pk, self.variant.pk, 4)
+        self.assertEqual(get_catalog_version(), version)  # still in stock: cached listings stay valid
+
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_cart_line(self.cart.pk, self.variant.pk, 6)  # the last units
+        self.assertGreater(get_catalog_version(), version)
+        self.assertFalse(Product.objects.get(pk=self.product.pk).in_stock)
+
+    def test_admin_restock_while_held(self):
+        stale = ProductVariant.objects.get(pk=self.variant.pk)  # e.g. the admin changelist form
+        hold_cart_line(self.cart.pk, self.variant.pk, 5)
+        stale.stock_quantity = 20
+        stale.save()
+        self.assertEqual(self.reserved(), 5)
+        self.assertEqual(stale.reserved_quantity, 5)
+
+        release_cart_lines(CartItem.objects.filter(cart=self.cart), delete=True)
+        self.assertEqual(self.reserved(), 0)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).stock_quantity, 20)
+
+
+class GroupedReleaseTests(TestCase):
+    """Releasing holds costs the same few queries whatever the number of lines and variants."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(product_name='Oxford shirt', slug='oxford-shirt', category=category)
+        self.variants = [
+            ProductVariant.objects.create(product=product, size=f'S{index}', color='Blue', price='20.00', stock_quantity=10)
+            for index in range(8)
+        ]
+        self.carts = [Cart.objects.create(user=User.objects.create_user(f'shirts-{index}')) for index in range(2)]
+
+    def hold(self, lines):
+        for cart in self.carts:
+            for variant in self.variants[:lines]:
+                hold_cart_line(cart.pk, variant.pk, 2)
+
+    def test_query_count_is_flat(self):
+        counts = []
+        for lines in (2, 8):
+            self.hold(lines)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(release_cart_lines(CartItem.objects.all(), delete=True), 2 * lines)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(set(ProductVariant.objects.values_list('reserved_quantity', flat=True)), {0})
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_regular_and_hot_variants(self):
+        designate_hot_variant(self.variants[0].pk, 2)
+        self.hold(2)
+        release_stock({self.variants[0].pk: 4, self.variants[1].pk: 4})
+        self.assertEqual(hot_available(self.variants[0].pk), 10)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variants[1].pk).reserved_quantity, 0)
+
+
+class CartQueryCountTests(TestCase):
+    """Cart endpoints cost a fixed number of queries, whatever the number of lines."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shirts', slug='shirts')
+        product = Product.objects.create(product_name='Oxford shirt', slug='oxford-shirt', category=category)
+        self.variants = [
+            ProductVariant.objects.create(product=product, size=f'S{index}', color='Blue', price='20.00', stock_quantity=50)
+            for index in range(12)
+        ]
+        self.user = User.objects.create_user('shopper')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self, lines):
+        response = self.client.post('/api/cart/items/bulk/', {
+            'items': [{'variant_id': variant.pk, 'quantity': 1} for variant in self.variants[:lines]],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_id_is_cached(self):
+        cart_id = get_cart_id(self.user)
+        self.assertEqual(cache.get(cart_id_key(self.user.pk)), cart_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cart_id(self.user), cart_id)
+
+    def test_retrieve_does_not_grow_with_lines(self):
+        # cart + user, lines + variants + products
+        self.fill_cart(1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(len(response.json()['items']), 1)
+
+        self.fill_cart(10)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(len(response.json()['items']), 10)
+
+    def test_add_item(self):
+        self.fill_cart(1)
+        # savepoint, read line, claim stock, write line, refresh summary, refresh cart totals, release savepoint
+        with self.assertNumQueries(7):
+            response = self.client.post('/api/cart/items/', {'variant_id': self.variants[0].pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['quantity'], 3)
+
+    def test_clear_does_not_grow_with_lines(self):
+        # savepoint, lock variants, read lines, hot variants, grouped release, delete, cart totals,
+        # refresh summary, release
+        self.fill_cart(1)
+        with self.assertNumQueries(9):
+            self.client.delete('/api/cart/')
+        self.fill_cart(10)
+        with self.assertNumQueries(9):
+            self.assertEqual(self.client.delete('/api/cart/').status_code, 204)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(sum(ProductVariant.objects.values_list('reserved_quantity', flat=True)), 0)
+
+    def test_deleted_cart_is_recreated(self):
+        self.fill_cart(2)
+        Cart.objects.filter(user=self.user).delete()
+        self.assertIsNone(cache.get(cart_id_key(self.user.pk)))
+        response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [])
+
+    def test_summary_is_one_row_read(self):
+        self.fill_cart(3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.json(), {'item_count': 3, 'grand_total': 60.0})
+
+
+class CartTotalsTests(TestCase):
+    """The stored item_count/subtotal follow every cart mutation."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Shoes', slug='shoes')
+        product = Product.objects.create(product_name='Runner', slug='runner', category=category)
+        self.cheap = ProductVariant.objects.create(product=product, size='40', color='Red', price='10.00', stock_quantity=20)
+        self.dear = ProductVariant.objects.create(product=product, size='41', color='Red', price='25.50', stock_quantity=20)
+        self.user = User.objects.create_user('runner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertTotals(self, item_count, subtotal):
+        cart = Cart.objects.with_live_totals().get(user=self.user)
+        self.assertEqual((cart.item_count, cart.subtotal), (item_count, Decimal(subtotal)))
+        self.assertEqual((cart.live_item_count, cart.live_subtotal), (item_count, Decimal(subtotal)))
+
+    def test_add_update_remove(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.cheap.pk, 'quantity': 2})
+        response = self.client.post('/api/cart/items/', {'variant_id': self.dear.pk, 'quantity': 1})
+        self.assertTotals(3, '45.50')
+
+        self.client.patch(f'/api/cart/items/{response.json()["id"]}/', {'quantity': 4})
+        self.assertTotals(6, '122.00')
+
+        self.client.delete(f'/api/cart/items/{response.json()["id"]}/')
+        self.assertTotals(2, '20.00')
+
+        self.client.delete('/api/cart/')
+        self.assertTotals(0, '0.00')
+
+    def test_price_change_reprices_carts(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.cheap.pk, 'quantity': 3})
+        self.cheap.price = Decimal('12.00')
+        self.cheap.save()
+        self.assertTotals(3, '36.00')
+
+    def test_deleted_variants_leave_carts(self):
+        self.client.post('/api/cart/items/', {'variant_id': self.cheap.pk, 'quantity': 2})
+        self.client.post('/api/cart/items/', {'variant_id': self.dear.pk, 'quantity': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(pk=self.dear.pk).delete()  # no ProductVariant.delete() call
+        self.assertTotals(2, '20.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cheap.product.delete()  # the variants go in the cascade
+        self.assertTotals(0, '0.00')
+
+
+class GuestCartTests(TestCase):
+    """Guests shop with an X-Cart-Token cart that is merged into the user's cart at login."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Hats', slug='hats')
+        product = Product.objects.create(product_name='Beanie', slug='beanie', category=category)
+        self.grey = ProductVariant.objects.create(product=product, size='M', color='Grey', price='15.00', stock_quantity=5)
+        self.navy = ProductVariant.objects.create(product=product, size='M', color='Navy', price='15.00', stock_quantity=5)
+        self.user = User.objects.create_user('guest', password='secret-password')
+        self.client = APIClient()
+
+    def add_as_guest(self, variant, quantity, token=None):
+        headers = {'HTTP_X_CART_TOKEN': token} if token else {}
+        response = self.client.post('/api/cart/items/', {'variant_id': variant.pk, 'quantity': quantity}, **headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get('X-Cart-Token') or token
+
+    def test_guest_cart_is_created_on_first_add(self):
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+        self.assertFalse(Cart.objects.exists())
+
+        token = self.add_as_guest(self.grey, 2)
+        self.assertTrue(token)
+        self.assertEqual(self.add_as_guest(self.grey, 1, token), token)
+        cart = self.client.get('/api/cart/', HTTP_X_CART_TOKEN=token).json()
+        self.assertEqual((cart['user'], cart['item_count']), (None, 3))
+
+    def test_failed_first_add_leaves_no_cart(self):
+        response = self.client.post('/api/cart/items/', {'variant_id': self.grey.pk + 1000, 'quantity': 1})
+        self.assertEqual(response.json(), {'variant_id': ['There is no variant with the given ID.']})
+        response = self.client.post('/api/cart/items/', {'variant_id': self.grey.pk + 1000, 'quantity': 0})
+        self.assertIn('quantity', response.json())
+        self.assertIsNone(response.get('X-Cart-Token'))
+        self.assertFalse(Cart.objects.exists())
+
+    def test_login_merges_guest_cart(self):
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/items/', {'variant_id': self.grey.pk, 'quantity': 1})
+        self.client.force_authenticate(None)
+        token = self.add_as_guest(self.grey, 2)
+        self.add_as_guest(self.navy, 5, token)
+        response = self.client.post('/api/token/', {'username': 'guest', 'password': 'secret-password'},
+                                    HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(cart.items.values_list('variant_id', 'quantity')), {self.grey.pk: 3, self.navy.pk: 5})
+        self.assertEqual(cart.item_count, 8)
+        self.assertFalse(Cart.objects.filter(guest_token=token).exists())
+        self.assertEqual(ProductVariant.objects.get(pk=self.grey.pk).reserved_quantity, 3)
+        self.assertEqual(ProductVariant.objects.get(pk=self.navy.pk).reserved_quantity, 5)
+
+    def test_merge_caps_lines_at_available_stock(self):
+        token = self.add_as_guest(self.grey, 4)
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/items/', {'variant_id': self.grey.pk, 'quantity': 1})
+        # stock count corrected down: only 2 of the guest's 4 can still be held next to the user's 1
+        self.grey.refresh_from_db()
+        self.grey.stock_quantity = 3
+        self.grey.save()
+
+        response = self.client.post('/api/cart/merge/', HTTP_X_CART_TOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['quantity'], 3)
+        self.assertEqual(response.json()['rejected'], [{'variant_id': self.grey.pk, 'detail': 'Not enough stock. Available: 2'}])
+        self.assertEqual(ProductVariant.objects.get(pk=self.grey.pk).reserved_quantity, 3)
+
+    def test_sweep_removes_abandoned_guest_carts(self):
+        from .carts import sweep_guest_carts
+        token = self.add_as_guest(self.grey, 2)
+        Cart.objects.filter(guest_token=token).update(updated_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(sweep_guest_carts(), 1)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(ProductVariant.objects.get(pk=self.grey.pk).reserved_quantity, 0)
+        self.assertEqual(self.client.get('/api/cart/', HTTP_X_CART_TOKEN=token).json()['items'], [])
+
+
+class UnknownVariantTests(TransactionTestCase):
+    """A line for a missing variant is refused at commit (deferred FK), not retried as a lost race."""
+
+    def test_hold_without_claim_reports_unknown_variant(self):
+        cart = Cart.objects.create(guest_token='unknown-variant')
+        with self.assertRaises(ProductVariant.DoesNotExist):
+            hold_cart_line(cart.pk, 424242, 0)  # nothing to claim, so only the FK notices
+        self.assertFalse(CartItem.objects.exists())
+
+
+class BulkCartTests(TestCase):
+    """POST /api/cart/items/bulk/ applies many lines at once: all or nothing, or what fits with `atomic: false`."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Socks', slug='socks')
+        product = Product.objects.create(product_name='Ankle sock', slug='ankle-sock', category=category)
+        self.black, self.white = (
+            ProductVariant.objects.create(product=product, size='M', color=color, price='4.00', stock_quantity=5)
+            for color in ('Black', 'White')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('sock-drawer'))
+
+    def bulk(self, items, **options):
+        return self.client.post('/api/cart/items/bulk/', {
+            'items': [{'variant_id': variant_id, 'quantity': quantity} for variant_id, quantity in items],
+            **options,
+        }, format='json')
+
+    def lines(self):
+        return dict(CartItem.objects.values_list('variant__color', 'quantity'))
+
+    def reserved(self):
+        return dict(ProductVariant.objects.values_list('color', 'reserved_quantity'))
+
+    def test_atomic(self):
+        response = self.bulk([(self.black.pk, 2), (self.black.pk, 1), (self.white.pk, 6)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([line['detail'] for line in response.json()['rejected']], ['Not enough stock. Available: 5'])
+        self.assertEqual(self.lines(), {})
+        self.assertEqual(self.reserved(), {'Black': 0, 'White': 0})
+
+        response = self.bulk([(self.black.pk, 2), (self.black.pk, 1), (self.white.pk, 5)])  # repeats add up
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(), {'Black': 3, 'White': 5})
+        self.assertEqual(self.reserved(), {'Black': 3, 'White': 5})
+
+    def test_partial(self):
+        response = self.bulk([(self.black.pk, 2), (self.white.pk, 6), (self.white.pk + 100, 1)], atomic=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(line['variant_id'] for line in response.json()['rejected']), [self.white.pk, self.white.pk + 100])
+        self.assertEqual(self.lines(), {'Black': 2})
+
+    def test_set(self):
+        self.bulk([(self.black.pk, 2), (self.white.pk, 2)])
+        self.assertEqual(self.bulk([(self.black.pk, 0)]).status_code, 400)  # adding needs quantities of at least 1
+
+        self.assertEqual(self.bulk([(self.black.pk, 0), (self.white.pk, 4)], mode='set').status_code, 200)
+        self.assertEqual(self.lines(), {'White': 4})
+        self.assertEqual(self.reserved(), {'Black': 0, 'White': 4})
+
+
+class HotVariantTests(TestCase):
+    """A hot variant's available units live in stock buckets, rebalanced against the cart holds."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Drops', slug='drops')
+        product = Product.objects.create(product_name='Sneaker drop', slug='sneaker-drop', category=category)
+        self.variant = ProductVariant.objects.create(product=product, size='42', color='White', price='120.00',
+                                                     stock_quantity=10)
+        designate_hot_variant(self.variant.pk, 4)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('sneakerhead'))
+
+    def add(self, quantity):
+        return self.client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': quantity})
+
+    def buckets(self):
+        return list(StockBucket.objects.filter(variant=self.variant).order_by('index').values_list('quantity', flat=True))
+
+    def in_stock(self):
+        return self.client.get('/api/products/').json()['results'][0]['in_stock']
+
+    def reserved(self):
+        return ProductVariant.objects.values_list('reserved_quantity', flat=True).get(pk=self.variant.pk)
+
+    def test_claims_and_reconcile(self):
+        self.assertEqual(self.buckets(), [3, 3, 2, 2])
+
+        self.assertEqual(self.add(2).status_code, 201)
+        self.assertEqual(hot_available(self.variant.pk), 8)
+        self.assertEqual(self.reserved(), 0)  # the variant row is left alone until reconciled
+        out = io.StringIO()
+        call_command('reconcile_stock_buckets', stdout=out)
+        self.assertIn('Reconciled 1 hot variants', out.getvalue())
+        self.assertEqual((self.reserved(), self.buckets()), (2, [2, 2, 2, 2]))
+
+        self.assertEqual(self.add(5).status_code, 201)  # more than any one bucket holds
+        self.assertEqual(hot_available(self.variant.pk), 3)
+        self.assertEqual(reconcile_hot_variant(self.variant.pk), 3)
+        self.assertEqual(self.reserved(), 7)
+        response = self.add(4)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Available: 3', response.content.decode())
+
+        line = CartItem.objects.get()
+        self.assertEqual(self.client.patch(f'/api/cart/items/{line.pk}/', {'quantity': 1}).status_code, 200)
+        self.assertEqual(hot_available(self.variant.pk), 9)  # 6 units back into a bucket
+
+    def test_sold_out_is_not_advertised(self):
+        url = f'/api/products/{self.variant.product_id}/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add(3)
+        self.assertEqual(self.client.get(url).json()['variants'][0]['stock_quantity'], 7)  # from the buckets
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for quantity in (3, 2, 2):  # the last claim empties the last bucket
+                self.assertEqual(self.add(quantity).status_code, 201)
+        self.assertEqual(self.buckets(), [0, 0, 0, 0])
+        product = self.client.get(url).json()
+        self.assertEqual(product['variants'][0]['stock_quantity'], 0)
+        self.assertFalse(self.in_stock())
+
+        line = CartItem.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/cart/items/{line.pk}/', {'quantity': 9})
+        product = self.client.get(url).json()
+        self.assertEqual(product['variants'][0]['stock_quantity'], 1)
+        self.assertTrue(self.in_stock())
+
+    def test_failed_claim_refreshes_the_summary(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.add(10).status_code, 201)  # larger than any bucket: claimed while reconciling
+            self.assertEqual(self.add(1).status_code, 400)
+        product = self.client.get(f'/api/products/{self.variant.product_id}/').json()
+        self.assertEqual(product['variants'][0]['stock_quantity'], 0)
+        self.assertFalse(self.in_stock())
+
+    def test_undesignate(self):
+        self.add(3)
+        undesignate_hot_variant(self.variant.pk)
+        self.assertFalse(StockBucket.objects.exists())
+        self.assertEqual(self.reserved(), 3)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_quantity, 7)
+
+
+@override_settings(SQLITE_BUSY_RETRIES=50)
+class HotVariantConcurrencyTests(TransactionTestCase):
+    """Concurrent adds on a bucketed variant never hold more units than there are."""
+
+    def test_concurrent_claims_never_oversell(self):
+        category = Category.objects.create(name='Drops', slug='drops')
+        product = Product.objects.create(product_name='Sneaker drop', slug='sneaker-drop', category=category)
+        variant = ProductVariant.objects.create(product=product, size='42', color='White', price='120.00',
+                                                stock_quantity=30)
+        designate_hot_variant(variant.pk, 4)
+        carts = [Cart.objects.create(guest_token=f'drop-{index}') for index in range(8)]
+        held = []
+
+        def shopper(cart):
+            try:
+                for _ in range(6):  # 48 adds for 30 units
+                    item, _ = hold_cart_line(cart.pk, variant.pk, 1)
+                    if item is not None:
+                        held.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shopper, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(held), 30)
+        self.assertEqual(CartItem.objects.aggregate(total=Sum('quantity'))['total'], 30)
+        self.assertEqual(hot_available(variant.pk), 0)
+        self.assertEqual(reconcile_hot_variant(variant.pk), 0)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).reserved_quantity, 30)
+
+
+@override_settings(SQLITE_BUSY_RETRIES=0)
+class ConcurrentAddTests(TransactionTestCase):
+    """Concurrent adds on a regular variant wait for the write lock instead of failing with "database is locked"."""
+
+    def test_concurrent_adds_all_succeed(self):
+        self.assertFalse(connection.is_in_memory_db())  # the busy timeout only applies to a file
+        category = Category.objects.create(name='Socks', slug='socks')
+        product = Product.objects.create(product_name='Wool socks', slug='wool-socks', category=category)
+        variant = ProductVariant.objects.create(product=product, size='M', color='Grey', price='9.00', stock_quantity=100)
+        carts = [Cart.objects.create(guest_token=f'socks-{index}') for index in range(8)]
+        held, errors = [], []
+
+        def shopper(cart):
+            try:
+                for _ in range(5):
+                    item, _ = hold_cart_line(cart.pk, variant.pk, 1)
+                    held.append(item is not None)
+            except Exception as exc:  # reported below; a thread's exception would otherwise just be printed
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shopper, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(held, [True] * 40)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).reserved_quantity, 40)
+        self.assertEqual(list(Cart.objects.values_list('item_count', flat=True).distinct()), [5])
+
+
+class CheckoutTests(TestCase):
+    """Checkout turns held stock into an order exactly once per Idempotency-Key."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Bags', slug='bags')
+        product = Product.objects.create(product_name='Tote', slug='tote', category=category)
+        self.variant = ProductVariant.objects.create(product=product, size='L', color='Sand', price='30.00', stock_quantity=10)
+        self.user = User.objects.create_user('buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': 3})
+
+    def checkout(self, key='order-1'):
+        return self.client.post('/api/orders/', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_checkout_commits_held_stock(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['item_count'], response.json()['total']), (3, '90.00'))
+        self.assertEqual(response.json()['lines'][0]['product_name'], 'Tote')
+
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock_quantity, self.variant.reserved_quantity), (7, 0))
+        self.assertEqual(self.client.get('/api/cart/summary/').json()['item_count'], 0)
+
+    def test_retry_replays_the_same_order(self):
+        first = self.checkout()
+        self.client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': 1})
+        retry = self.checkout()
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock_quantity, self.variant.reserved_quantity), (7, 1))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_holds_are_taken_again(self):
+        CartItem.objects.update(reserved_quantity=0, reserved_until=None)
+        ProductVariant.objects.filter(pk=self.variant.pk).update(reserved_quantity=0, stock_quantity=2)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['rejected'], [{'variant_id': self.variant.pk, 'detail': 'Not enough stock. Available: 2'}])
+        self.assertFalse(Order.objects.exists())
+
+    def test_requires_key_and_items(self):
+        self.assertEqual(self.client.post('/api/orders/').status_code, 400)
+        self.client.delete('/api/cart/')
+        self.assertEqual(self.checkout().status_code, 409)
+
+
+class StatelessAuthTests(TestCase):
+    """Cart endpoints take the user from the JWT claims; revocation goes through the RevokedToken denylist."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('token-holder', password='secret-password')
+        self.client = APIClient()
+        self.access = self.client.post('/api/token/', {'username': 'token-holder', 'password': 'secret-password'}).json()['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.client.get('/api/cart/summary/')  # creates the cart and caches its id
+
+    def test_no_user_query(self):
+        # only the cart row: no SELECT on auth_user, and the denylist is checked in memory
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/summary/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoked_token_is_refused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/token/revoke/').status_code, 204)
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, 401)
+
+    def test_deactivated_user_is_refused(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, 401)
+
+    def test_revocations_survive_cache_churn(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/token/revoke/')
+        self.client.get('/api/cart/summary/')
+        cache.clear()  # e.g. culled by the response cache, or another worker's cache
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, 401)
+
+    def test_revocations_from_other_workers(self):
+        # a row written without bumping this worker's version (e.g. another worker with its own cache)
+        revoke_token(AccessToken(self.access))
+        self.assertEqual(self.client.get('/api/cart/summary/').status_code, 200)  # within the refresh interval
+        with override_settings(JWT_DENYLIST_REFRESH_SECONDS=0):
+            self.assertEqual(self.client.get('/api/cart/summary/').status_code, 401)
+
+    def test_expired_revocations_are_purged(self):
+        self.client.post('/api/token/revoke/')
+        RevokedToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_revoked_tokens(), 1)
+        self.assertFalse(RevokedToken.objects.exists())
+
+
+@override_settings(SQLITE_BUSY_RETRIES=2)
+class RetryOnBusyTests(SimpleTestCase):
+    """Outermost write transactions are re-run when they lose a lock race."""
+
+    def flaky(self, failures, message='database is locked'):
+        calls = []
+
+        @retry_on_busy
+        def write():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'done'
+        return write, calls
+
+    def test_retries_until_success(self):
+        write, calls = self.flaky(failures=2)
+        self.assertEqual(write(), 'done')
+        self.assertEqual(len(calls), 3)
+
+    def test_gives_up_after_retries(self):
+        write, calls = self.flaky(failures=3)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 3)
+
+    def test_write_paths_are_wrapped(self):
+        self.assertTrue(hasattr(merge_carts, '__wrapped__'))
+        # the sync wrapper must not end up around the async helpers next to it
+        self.assertTrue(inspect.iscoroutinefunction(aget_cart_id))
+        self.assertFalse(hasattr(aget_cart_id, '__wrapped__'))
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self.flaky(failures=1, message='no such table: catalog_cart')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+    """Catalogue reads go to a replica unless the request is pinned to the primary."""
+
+    router = PrimaryReplicaRouter()
+
+    def test_catalogue_reads_use_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), 'replica1')
+        self.assertIsNone(self.router.db_for_read(Cart))
+
+    def test_writes_pin_the_rest_of_the_request(self):
+        reset_token = _request_state.set({'pinned': False, 'wrote': False})
+        try:
+            self.assertEqual(self.router.db_for_read(ProductVariant), 'replica1')
+            self.assertEqual(self.router.db_for_write(CartItem), 'default')
+            self.assertIsNone(self.router.db_for_read(ProductVariant))
+        finally:
+            _request_state.reset(reset_token)
+
+    def test_cache_fills_read_the_primary_after_a_bump(self):
+        cache.delete(CATALOG_RECENT_BUMP_KEY)
+        with fill_reads():
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+        bump_catalog_version()  # a replica may not have the write yet: don't cache what it returns
+        self.addCleanup(cache.delete, CATALOG_RECENT_BUMP_KEY)
+        with fill_reads():
+            self.assertIsNone(self.router.db_for_read(Product))
+        self.assertEqual(self.router.db_for_read(Product), 'replica1')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+
+
+# the primary doubles as the "replica" so requests run for real inside the test transaction
+@override_settings(DATABASE_REPLICAS=['default'])
+class ReplicaPinningTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Scarves', slug='scarves')
+        product = Product.objects.create(product_name='Wool scarf', slug='wool-scarf', category=category)
+        self.variant = ProductVariant.objects.create(product=product, size='L', color='Red', price='25.00', stock_quantity=5)
+        self.client = APIClient()
+
+    def test_cart_write_pins_the_shopper(self):
+        response = self.client.post('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(cache.get(replica_pin_key(cart_owner(response['X-Cart-Token']))), 1)
+
+    def test_reads_do_not_pin(self):
+        self.client.get('/api/products/', HTTP_X_CART_TOKEN='reader')
+        self.assertIsNone(cache.get(replica_pin_key(cart_owner('reader'))))
+
+
+class AsyncViewTests(TestCase):
+    """Under ASGI the native async views answer with exactly the sync viewsets' bytes."""
+
+    def setUp(self):
+        cache.clear()
+        parent = Category.objects.create(name='Shoes', slug='shoes')
+        child = Category.objects.create(name='Boots', slug='boots', parent_category=parent)
+        self.product = Product.objects.create(product_name='Hiking boot', slug='hiking-boot', category=child)
+        self.variant = ProductVariant.objects.create(product=self.product, size='42', color='Brown', price='120.00',
+                                                     stock_quantity=4)
+        ProductVariant.objects.create(product=self.product, size='43', color='Brown', price='125.00', stock_quantity=0)
+        self.client = APIClient()
+        self.async_client = AsyncClient()
+
+    async def assertSamePayload(self, path, headers=None):
+        await cache.aclear()
+        response = await self.async_client.get(path, headers=headers)
+        await cache.aclear()
+        expected = await sync_to_async(self.client.get)(path, headers=headers)
+        self.assertEqual((response.status_code, response.content), (expected.status_code, expected.content))
+        return response
+
+    async def test_catalogue_payloads_match(self):
+        for path in ('/api/products/', '/api/products/?page=2&page_size=1', '/api/products/?cursor=&count=true',
+                     '/api/products/?category=shoes&expand=variants', f'/api/products/{self.product.pk}/',
+                     '/api/products/999/', '/api/products/?page=9', '/api/categories/tree/', '/api/products/?search=hik'):
+            with self.subTest(path=path):
+                search_backend._wrapped = empty  # as in a fresh worker: picked on first use, from async code
+                await self.assertSamePayload(path)
+
+    async def test_cached_response_is_shared(self):
+        response = await self.async_client.get('/api/products/')
+        expected = await sync_to_async(self.client.get)('/api/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(expected.status_code, 304)
+
+    async def test_cart_payload_matches(self):
+        added = await sync_to_async(self.client.post)('/api/cart/items/', {'variant_id': self.variant.pk, 'quantity': 2})
+        token = added['X-Cart-Token']
+        await self.assertSamePayload('/api/cart/', {'X-Cart-Token': token})
+        await self.assertSamePayload('/api/cart/', {'Authorization': 'Bearer not-a-token'})
+
+        # methods without a native view fall back to the sync viewset
+        response = await self.async_client.delete('/api/cart/', headers={'X-Cart-Token': token})
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(await CartItem.objects.filter(cart__guest_token=token).aexists())
+
+
+class ImageDerivativeTests(TestCase):
+    """Uploads get resized WebP/JPEG copies, exposed as a srcset and used for listing thumbnails."""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, PRODUCT_IMAGE_WORKERS=0,
+                                            PRODUCT_IMAGE_WIDTHS=[160, 320, 640], PRODUCT_IMAGE_BLOB_GRACE_SECONDS=0))
+        category = Category.objects.create(name='Bags', slug='bags')
+        self.product = Product.objects.create(product_name='Tote', slug='tote', category=category)
+
+    @staticmethod
+    def jpeg(size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (120, 80, 40)).save(buffer, 'JPEG')
+        return ContentFile(buffer.getvalue())
+
+    def upload(self, size, name='tote.jpg'):
+        image = ProductImage(product=self.product)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image.save(name, self.jpeg(size))
+        image.refresh_from_db()
+        return image
+
+    def test_srcset_lists_generated_sizes(self):
+        image = self.upload((500, 400))
+        srcset = self.client.get(f'/api/products/{self.product.pk}/').json()['product_images'][0]['srcset']
+        self.assertEqual(set(srcset), {'webp', 'jpeg'})
+        self.assertEqual(set(srcset['webp']), {'160', '320'})  # never upscaled past the 500px original
+        with image.image.storage.open(image.derivatives['sizes']['jpeg']['320']) as derived:
+            self.assertEqual(Image.open(derived).size, (320, 256))
+
+    def test_listing_thumbnail_uses_derivative(self):
+        self.upload((1000, 1000))
+        thumbnail = self.client.get('/api/products/?fields=id,thumbnail').json()['results'][0]['thumbnail']
+        self.assertRegex(thumbnail, r'/products/[0-9a-f]{2}/derived/[0-9a-f]{64}-320w-q80\.webp$')
+
+    def test_replaced_upload_drops_stale_srcset(self):
+        image = self.upload((500, 400))
+        ProductImage.objects.filter(pk=image.pk).update(image='products/other.jpg')
+        srcset = self.client.get(f'/api/products/{self.product.pk}/').json()['product_images'][0]['srcset']
+        self.assertEqual(srcset, {})
+
+    def test_identical_uploads_share_one_file_until_the_last_is_deleted(self):
+        first = self.upload((500, 400))
+        second = self.upload((500, 400), name='copy.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.derivatives, second.derivatives)  # rendered once, shared
+        storage = first.image.storage
+        files = {first.image.name} | derivative_paths(first.derivatives)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(all(storage.exists(name) for name in files))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(any(storage.exists(name) for name in files))
+
+    def test_replaced_upload_releases_the_old_file(self):
+        image = self.upload((500, 400))
+        old_name = image.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image.save('new.jpg', self.jpeg((300, 300)))
+        self.assertNotEqual(image.image.name, old_name)
+        self.assertFalse(image.image.storage.exists(old_name))
+
+    def test_content_addressed_media_is_served_immutable(self):
+        image = self.upload((200, 200))
+        request = RequestFactory().get('/media/' + image.image.name)
+        response = serve_media(request, image.image.name)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        etag = response['ETag']
+        self.assertIn(hashlib.sha256(b''.join(response.streaming_content)).hexdigest(), etag)
+
+        request = RequestFactory().get('/media/' + image.image.name, headers={'If-None-Match': etag})
+        self.assertEqual(serve_media(request, image.image.name).status_code, 304)
+
+    def test_compaction_moves_legacy_files_and_deletes_orphans(self):
+        storage = ProductImage._meta.get_field('image').storage
+        legacy = FileSystemStorage().save('products/legacy.jpg', self.jpeg((100, 100)))
+        image = ProductImage.objects.create(product=self.product, image=legacy)
+        orphan = self.upload((120, 120))
+        orphan.delete()  # its release callback never runs (no commit in a TestCase): the files stay behind
+
+        call_command('compact_product_images', stdout=io.StringIO())
+        image.refresh_from_db()
+        self.assertRegex(image.image.name, r'^products/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertTrue(storage.exists(image.image.name))
+        self.assertFalse(storage.exists(legacy))
+        self.assertFalse(any(storage.exists(name)
+                             for name in {orphan.image.name} | derivative_paths(orphan.derivatives)))
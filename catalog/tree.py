@@ -0,0 +1,53 @@
+from django.core.cache import cache
+
+from .models import Category
+
+CATEGORY_TREE_CACHE_KEY = 'catalog:category-tree'
+
+
+def nest_categories(rows):
+    """
+    Nest category rows (ordered by the materialized path) in memory.
+    Ordering by path guarantees a parent is always seen before its children.
+    """
+    nodes = {}
+    roots = []
+    for row in rows:
+        parent_id = row.pop('parent_category_id')
+        node = {**row, 'subcategories': []}
+        nodes[node['id']] = node
+        if parent_id is None:
+            roots.append(node)
+        else:
+            nodes[parent_id]['subcategories'].append(node)
+    return roots
+
+
+def category_rows():
+    return Category.objects.order_by('path').values('id', 'name', 'slug', 'full_name', 'parent_category_id')
+
+
+def build_category_tree():
+    # Every category in one query, nested in memory.
+    return nest_categories(category_rows())
+
+
+def get_category_tree():
+    # Served straight from the cache in steady state; rebuilt lazily after any category change.
+    tree = cache.get(CATEGORY_TREE_CACHE_KEY)
+    if tree is None:
+        tree = build_category_tree()
+        cache.set(CATEGORY_TREE_CACHE_KEY, tree, timeout=None)
+    return tree
+
+
+async def aget_category_tree():
+    tree = await cache.aget(CATEGORY_TREE_CACHE_KEY)
+    if tree is None:
+        tree = nest_categories([row async for row in category_rows()])
+        await cache.aset(CATEGORY_TREE_CACHE_KEY, tree, timeout=None)
+    return tree
+
+
+def invalidate_category_tree():
+    cache.delete(CATEGORY_TREE_CACHE_KEY)
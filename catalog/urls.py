@@ -7,10 +7,13 @@ router = DefaultRouter()
 router.register(r'products', views.ProductViewSet, basename='product')
 router.register(r'categories', views.CategoryViewSet, basename='category')
 router.register(r'cart/items', views.CartItemViewSet, basename='cart-item')
+router.register(r'orders', views.OrderViewSet, basename='order')
 
 
 urlpatterns = [
     path('', include(router.urls)),
     path('cart/', views.CartViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}), name='cart-detail'),
+    path('cart/summary/', views.CartViewSet.as_view({'get': 'summary'}), name='cart-summary'),
+    path('cart/merge/', views.CartViewSet.as_view({'post': 'merge'}), name='cart-merge'),
 ]
 
@@ -1,97 +1,284 @@
 from rest_framework import viewsets , mixins , status 
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db import transaction
-from django.db.models import F
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotAuthenticated, ValidationError
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
 
-from rest_framework.filters import SearchFilter , OrderingFilter 
 from rest_framework.permissions import IsAuthenticated, AllowAny 
-from django.db.models import Prefetch 
+from django.conf import settings
+from django.db.models import JSONField, OuterRef, Prefetch, Subquery
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.views.static import serve
 
-from .models import Category, Product, ProductVariant, Cart, CartItem
-from .serializers import (CategorySerializer, ProductSerializer, CartSerializer,
-                        CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer)
+from .models import Category, Product, ProductImage, ProductVariant, Cart, CartItem, Order
+from .authentication import StatelessJWTAuthentication, revoke_token
+from .caching import CachedResponseMixin, query_cache_key
+from .carts import CartOwnerMixin, cart_with_items, get_cart, get_cart_id, load_cart, merge_guest_cart
+from .db import pin_to_primary, user_owner
+from .facets import compute_facets
+from .fastpath import FastSerializationMixin
+from .filters import ProductFilter, ProductOrderingFilter, ProductSearchFilter
+from .orders import CheckoutError, place_order
+from .pagination import KeysetPagination
+from .reservations import release_cart_lines
+from .storage import is_content_addressed
+from .tree import get_category_tree
+from .serializers import (CategorySerializer, ProductSerializer, ProductListSerializer, CartSerializer,
+                        CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, BulkCartItemSerializer,
+                        OrderSerializer)
 
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
 
-    queryset = Category.objects.filter(parent_category=None).prefetch_related('subcategories')
+    queryset = Category.objects.filter(parent_category=None).order_by('path').prefetch_related(
+        Prefetch('subcategories', queryset=Category.objects.order_by('path'))
+    )
     serializer_class = CategorySerializer
     permission_classes =[AllowAny]
 
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def tree(self, request):
+        # Full-depth menu tree, built from a single query and cached until a category changes.
+        return Response(get_category_tree())
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
-    serializer_class = ProductSerializer
+
+class ProductViewSet(CachedResponseMixin, FastSerializationMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
 
-    filter_backends = [DjangoFilterBackend, SearchFilter , OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter , ProductOrderingFilter]
     
-    filterset_fields = {
-        'category__slug': ['exact'],
-        'variants__price': ['gte', 'lte'] # Filter by price range
-    }
-    search_fields = ['product_name', 'description']
-    ordering_fields = ['variants__price', 'created_at']
+    filterset_class = ProductFilter
+    ordering_fields = ['min_price', 'max_price', 'created_at', 'variants__price'] # variants__price kept for old clients
+    ordering = ['-created_at']
+
+    fast_serialization_actions = ('list',)
+    facets_cache_timeout = 30 # seconds; facet counts may lag writes by this much
+    facets_ignored_params = ('page', 'page_size', 'cursor', 'count', 'ordering')
+
+    @property
+    def paginator(self):
+        # ?cursor= (empty for the first page) opts into keyset pagination; page numbers otherwise
+        if not hasattr(self, '_paginator') and self.request is not None \
+                and KeysetPagination.cursor_query_param in self.request.query_params:
+            self._paginator = KeysetPagination()
+        return super().paginator
+
+    def get_serializer_class(self):
+        # lean cards for listings, full nested product for the detail page
+        if self.action == 'retrieve':
+            return ProductSerializer
+        return ProductListSerializer
+
+    def shows_stock(self, request, action):
+        # variants carry stock_quantity, which every cart hold changes
+        serializer_class = ProductSerializer if action == 'retrieve' else ProductListSerializer
+        return action in ('list', 'retrieve') and 'variants' in serializer_class.selected_fields(request.GET)
 
     def get_queryset(self):
         queryset = Product.objects.filter(is_active = True)
 
-        return queryset.select_related('category').prefetch_related(
-            Prefetch('variants', queryset=ProductVariant.objects.order_by('price')), 'product_images'
+        # only join/prefetch what the selected fields will actually render
+        fields = self.get_serializer_class().selected_fields(self.request.query_params)
+        if 'category' in fields:
+            queryset = queryset.select_related('category')
+        if 'variants' in fields:
+            queryset = queryset.prefetch_related(Prefetch('variants', queryset=ProductVariant.objects.with_bucket_stock().order_by('price')))
+        if 'product_images' in fields:
+            queryset = queryset.prefetch_related('product_images')
+        if 'thumbnail' in fields:
+            first_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by('pk')
+            queryset = queryset.annotate(
+                thumbnail_path=Subquery(first_image.values('image')[:1]),
+                thumbnail_derivatives=Subquery(first_image.values('derivatives')[:1], output_field=JSONField()),
             )
+        return queryset
+
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def facets(self, request):
+        # Category/size/color/price counts for the same filters as the listing, briefly cached per filter set.
+        key = query_cache_key('catalog:facets', request, ignore=self.facets_ignored_params)
+        data = cache.get(key)
+        if data is None:
+            data = compute_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(key, data, self.facets_cache_timeout)
+        return Response(data)
     
-class CartViewSet(mixins.RetrieveModelMixin,mixins.DestroyModelMixin, viewsets.GenericViewSet):
+class CartViewSet(CartOwnerMixin, FastSerializationMixin, mixins.RetrieveModelMixin,mixins.DestroyModelMixin, viewsets.GenericViewSet):
     serializer_class = CartSerializer
-    permission_classes = [IsAuthenticated]
+    authentication_classes = [StatelessJWTAuthentication]  # request.user from the token, no User query
+    permission_classes = [AllowAny]  # guests shop with an X-Cart-Token cart
+    fast_serialization_actions = ('retrieve',)
+    # what a guest who hasn't added anything yet sees, without creating a cart for them
+    empty_cart = {'id': None, 'user': None, 'items': [], 'item_count': 0, 'grand_total': 0, 'created_at': None}
 
     def get_queryset(self):
-        return Cart.objects.prefetch_related('items__variant__product').filter(user=self.request.user)
+        return cart_with_items().filter(pk=self.get_cart_id(create=False))
 
     def get_object(self):
-        cart , _ = Cart.objects.get_or_create(user=self.request.user)
-        return cart 
+        # cached cart id + two queries for the cart and its lines, however many lines there are
+        if self.request.user.is_authenticated:
+            return get_cart(self.request.user)
+        cart_id = self.get_cart_id(create=False)
+        return load_cart(cart_id) if cart_id else None
+
+    def retrieve(self, request, *args, **kwargs):
+        cart = self.get_object()
+        if cart is None:
+            return Response(self.empty_cart)
+        return Response(self.get_serializer(cart).data)
     
+    def summary(self, request, *args, **kwargs):
+        # mini-cart badge / header: one row read, no lines loaded
+        totals = Cart.objects.filter(pk=self.get_cart_id(create=False)).values('item_count', 'subtotal').first()
+        if totals is None:
+            return Response({'item_count': 0, 'grand_total': 0})
+        return Response({'item_count': totals['item_count'], 'grand_total': totals['subtotal']})
+
     def destroy(self, request, *args, **kwargs):
-        cart = self.get_object()
-        with transaction.atomic():
-            # Restore stock for each cart item
-            for item in cart.items.select_for_update().all():
-                ProductVariant.objects.filter(pk=item.variant_id).update(
-                    stock_quantity=F('stock_quantity') + item.quantity
-                )
-            # delete items
-            cart.items.all().delete()
+        # give back every line's hold with one grouped UPDATE, then delete the lines
+        cart_id = self.get_cart_id(create=False)
+        if cart_id:
+            release_cart_lines(CartItem.objects.filter(cart_id=cart_id), delete=True)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def merge(self, request, *args, **kwargs):
+        # for clients already logged in: fold the guest cart named by X-Cart-Token into the user's cart
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        token = self.get_cart_token()
+        rejected = merge_guest_cart(token, request.user) if token else {}
+        data = CartSerializer(get_cart(request.user), context=self.get_serializer_context()).data
+        if rejected:
+            data['rejected'] = merge_rejections(rejected)
+        return Response(data)
+
 
-class CartItemViewSet(mixins.CreateModelMixin,mixins.DestroyModelMixin, mixins.UpdateModelMixin , viewsets.GenericViewSet):
+class CartItemViewSet(CartOwnerMixin, mixins.CreateModelMixin,mixins.DestroyModelMixin, mixins.UpdateModelMixin , viewsets.GenericViewSet):
     http_method_names = ['post','patch','delete']
-    permission_classes = [IsAuthenticated]
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [AllowAny]  # guests shop with an X-Cart-Token cart
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart__user=self.request.user)
+        return CartItem.objects.filter(cart_id=self.get_cart_id(create=False))
 
     def get_serializer_class(self):
         if self.action == 'create':
             return AddCartItemSerializer 
         elif self.action == 'partial_update':
             return UpdateCartItemSerializer 
+        elif self.action == 'bulk':
+            return BulkCartItemSerializer
         return CartItemSerializer
     
     def get_serializer_context(self):
-        cart, _ = Cart.objects.get_or_create(user=self.request.user)
-        return {'cart_id': cart.id, 'user': self.request.user}
+        # only adding may start a guest cart
+        cart_id = self.get_cart_id(create=self.action in ('create', 'bulk'))
+        return {'cart_id': cart_id, 'user': self.request.user}
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # Many lines in one transaction; answers with the resulting cart.
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rejected = serializer.save()
+
+        data = CartSerializer(load_cart(serializer.context['cart_id']), context=serializer.context).data
+        if rejected:
+            data['rejected'] = rejected
+        return Response(data)
 
     def perform_destroy(self, instance):
-       
-        with transaction.atomic():
-            # restore stock
-            ProductVariant.objects.filter(pk=instance.variant_id).update(
-                stock_quantity=F('stock_quantity') + instance.quantity
-            )
-            # then delete
-            instance.delete()
+        # release the line's hold (nothing left to release if it already expired), then delete it
+        release_cart_lines(CartItem.objects.filter(pk=instance.pk), delete=True)
 
-        
-    
+
+class OrderViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = OrderSerializer
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    idempotency_header = 'Idempotency-Key'
+
+    def get_queryset(self):
+        return Order.objects.filter(user_id=self.request.user.pk).prefetch_related('lines').order_by('-created_at')
+
+    def create(self, request, *args, **kwargs):
+        # Checkout: the whole cart becomes one order. Retries must resend the same Idempotency-Key.
+        key = request.headers.get(self.idempotency_header, '').strip()
+        if not key or len(key) > 64:
+            raise ValidationError({self.idempotency_header: ["Send a unique key (at most 64 characters) per checkout attempt."]})
+        try:
+            order, created = place_order(request.user, get_cart_id(request.user), key)
+        except CheckoutError as exc:
+            detail = {'detail': str(exc)}
+            if exc.failures:
+                detail['rejected'] = merge_rejections(exc.failures)
+            return Response(detail, status=status.HTTP_409_CONFLICT)
+
+        order = self.get_queryset().get(pk=order.pk)
+        response = Response(self.get_serializer(order).data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+        if not created:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class CartTokenObtainPairView(TokenObtainPairView):
+    """
+    JWT login that also merges the guest cart named by the X-Cart-Token header into the
+    user's cart, so clients don't replay their guest adds one by one after logging in.
+    """
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        data = dict(serializer.validated_data)
+        token = request.headers.get(CartOwnerMixin.cart_token_header)
+        if token:
+            rejected = merge_guest_cart(token, serializer.user)
+            pin_to_primary([user_owner(serializer.user.pk)])  # the merge moved stock; read it back from the primary
+            if rejected:
+                data['cart_rejected'] = merge_rejections(rejected)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class TokenRevokeView(APIView):
+    # Log out: the presented access token is refused from now on (see catalog.authentication).
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        revoke_token(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def merge_rejections(failures):
+    return [
+        {'variant_id': variant_id, 'detail': BulkCartItemSerializer.failure_message(available)}
+        for variant_id, available in failures.items()
+    ]
+
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def serve_media(request, path):
+    # Development media server. Content-addressed files never change under their name: browsers
+    # and CDNs may keep them for a year without revalidating, and the ETag is the content hash.
+    if not is_content_addressed(path):
+        return serve(request, path, document_root=settings.MEDIA_ROOT)
+    etag = '"%s"' % path.rsplit('/', 1)[-1].split('.', 1)[0]
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response['ETag'] = etag
+    return response